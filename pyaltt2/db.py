@@ -1,8 +1,13 @@
 """
 Extra mods required: sqlalchemy, msgpack (for KVStorage)
+
+Optional: lz4, zstandard (for KVStorage value compression)
 """
 import threading
+import importlib
 import os
+import atexit
+import weakref
 import datetime
 from types import SimpleNamespace
 from pyaltt2.crypto import gen_random_str
@@ -257,19 +262,267 @@ class Database:
             raise LookupError
 
 
+class KeyExistsError(ValueError):
+    """
+    Raised when the object already exists and overriding is not allowed
+    """
+
+
+KV_HEADER = b'\xc1'
+
+
+def _msgpack_dumps(value):
+    from msgpack import dumps
+    return dumps(value)
+
+
+def _msgpack_loads(data):
+    from msgpack import loads
+    return loads(data, raw=False)
+
+
+def _json_dumps(value):
+    return json.dumps(value).encode()
+
+
+def _json_loads(data):
+    return json.loads(data.decode())
+
+
+def _pickle_dumps(value):
+    import pickle
+    return pickle.dumps(value)
+
+
+def _pickle_loads(data):
+    import pickle
+    return pickle.loads(data)
+
+
+def _raw_dumps(value):
+    if not isinstance(value, (bytes, bytearray, memoryview)):
+        raise TypeError(
+            f'raw codec requires bytes, got {type(value).__name__}')
+    return bytes(value)
+
+
+def _raw_loads(data):
+    return data
+
+
+def _lz4_compress(data):
+    import lz4.frame
+    return lz4.frame.compress(data)
+
+
+def _lz4_decompress(data):
+    import lz4.frame
+    return lz4.frame.decompress(data)
+
+
+def _zstd_compress(data):
+    import zstandard
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _zstd_decompress(data):
+    import zstandard
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def _zlib_compress(data):
+    import zlib
+    return zlib.compress(data)
+
+
+def _zlib_decompress(data):
+    import zlib
+    return zlib.decompress(data)
+
+
+# name: (header id, dumps, loads)
+KV_CODECS = {
+    'msgpack': (0, _msgpack_dumps, _msgpack_loads),
+    'json': (1, _json_dumps, _json_loads),
+    'pickle': (2, _pickle_dumps, _pickle_loads),
+    'raw': (3, _raw_dumps, _raw_loads)
+}
+
+# name: (header id, compress, decompress, required module)
+KV_COMPRESSORS = {
+    'zlib': (1, _zlib_compress, _zlib_decompress, 'zlib'),
+    'lz4': (2, _lz4_compress, _lz4_decompress, 'lz4.frame'),
+    'zstd': (3, _zstd_compress, _zstd_decompress, 'zstandard')
+}
+
+# codec id of chunked stream objects
+KV_STREAM = 0xf
+
+_kv_codecs_by_id = {v[0]: v for v in KV_CODECS.values()}
+_kv_compressors_by_id = {v[0]: v for v in KV_COMPRESSORS.values()}
+
+
+def kv_encode(value, codec='msgpack', compression=None, compress_min=0):
+    """
+    Encode value for key-value storage
+
+    Encoded value starts with KV_HEADER byte (never used by msgpack), followed
+    by a byte with compression id (high nibble) and codec id (low nibble)
+
+    Args:
+        value: value to encode
+        codec: msgpack, json, pickle or raw (bytes)
+        compression: zlib, lz4, zstd or None
+        compress_min: compress values with encoded size >= compress_min only
+    Returns:
+        encoded value (bytes)
+    """
+    try:
+        codec_id, dumps, _ = KV_CODECS[codec]
+    except KeyError:
+        raise ValueError(f'Unsupported codec: {codec}')
+    data = dumps(value)
+    compression_id = 0
+    if compression and len(data) >= compress_min:
+        try:
+            compression_id, compress, _, _ = KV_COMPRESSORS[compression]
+        except KeyError:
+            raise ValueError(f'Unsupported compression: {compression}')
+        data = compress(data)
+    return KV_HEADER + bytes((compression_id << 4 | codec_id,)) + data
+
+
+def kv_decode(data):
+    """
+    Decode value from key-value storage
+
+    Values without KV_HEADER are decoded as plain msgpack (legacy format)
+
+    Args:
+        data: encoded value
+    Returns:
+        decoded value
+    """
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    if data[:1] != KV_HEADER:
+        return _msgpack_loads(data)
+    header = data[1]
+    data = data[2:]
+    if header & 0xf == KV_STREAM:
+        raise ValueError('stream object, use get_stream to read it')
+    compression_id = header >> 4
+    if compression_id:
+        data = _kv_compressors_by_id[compression_id][2](data)
+    return _kv_codecs_by_id[header & 0xf][2](data)
+
+
+def _kv_is_stream(data):
+    return bytes(data[:1]) == KV_HEADER and data[1] & 0xf == KV_STREAM
+
+
+def _check_kv_codec(codec, compression):
+    if codec not in KV_CODECS:
+        raise ValueError(f'Unsupported codec: {codec}')
+    if compression:
+        try:
+            importlib.import_module(KV_COMPRESSORS[compression][3])
+        except KeyError:
+            raise ValueError(f'Unsupported compression: {compression}')
+
+
+def _kv_expires(expires):
+    return datetime.datetime.now() + (datetime.timedelta(
+        seconds=expires) if isinstance(expires, int) else expires)
+
+
+KV_BATCH_SIZE = 500
+
+
+def _kv_prefix_upper(prefix):
+    prefix = prefix.rstrip(chr(0x10ffff))
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1) if prefix else None
+
+
+# write-behind storages, flushed on exit
+_kv_write_behind = weakref.WeakSet()
+
+
+def _kv_stop_write_behind():
+    for kv in list(_kv_write_behind):
+        kv.stop()
+
+
+atexit.register(_kv_stop_write_behind)
+
+
+def _kv_wb_loop(ref, event, interval):
+    # holds a weak reference only, so unused storages can be collected
+    import logging
+    while True:
+        event.wait(interval)
+        event.clear()
+        kv = ref()
+        if kv is None or not kv._wb_active:
+            return
+        try:
+            kv.flush()
+        except:
+            logging.getLogger('pyaltt2.db').error(
+                f'KVStorage {kv.table_name} flush failed', exc_info=True)
+        del kv
+
+
 class KVStorage:
     """
     Simple key-value database storage
     """
 
-    def __init__(self, db, table_name='kv'):
+    def __init__(self,
+                 db,
+                 table_name='kv',
+                 codec='msgpack',
+                 compression='zlib',
+                 compress_min=4096,
+                 write_behind=False,
+                 flush_interval=0.2,
+                 flush_size=1000,
+                 tags=False,
+                 streams=False,
+                 chunk_size=1048576):
         """
         Args:
             db: pyaltt2.db.Database
             table_name: storage table name (default: kv)
+            codec: value codec: msgpack (default), json, pickle or raw (bytes)
+            compression: compress large values: zlib (default), lz4, zstd or
+                None
+            compress_min: compress values larger than (default: 4096 bytes)
+            write_behind: buffer puts in memory and write them to the database
+                in batches by the background thread
+            flush_interval: write-behind flush interval (default: 0.2 sec)
+            flush_size: flush write-behind buffer as soon as it contains the
+                specified number of keys (default: 1000)
+            tags: enable object tags (stored in TABLE_NAME_tags table)
+            streams: enable chunked streams (stored in TABLE_NAME_chunks
+                table)
+            chunk_size: stream chunk size (default: 1 MiB)
+
+        Values are decoded with the codec and compression they were stored
+        with, so codec and compression can be changed for the existing
+        storage.
+
+        In write-behind mode, repeated puts of the same key are merged, the
+        buffer is flushed on exit, with flush() or stop(). Reads check the
+        buffer first, other operations flush it before executing. After
+        stop(), puts are written to the database directly.
         """
+        _check_kv_codec(codec, compression)
+        self.codec = codec
+        self.compression = compression
+        self.compress_min = compress_min
         from sqlalchemy import (MetaData, Table, VARCHAR, DateTime, LargeBinary,
-                                Column)
+                                BigInteger, Integer, Column, Index, inspect)
         if 'mysql' in db.get_engine().name:
             from sqlalchemy.dialects.mysql import DATETIME, LONGBLOB
             DateTime = partial(DATETIME, fsp=6)
@@ -285,9 +538,117 @@ class KVStorage:
                            primary_key=True),
                     Column('content', LargeBinary, nullable=True),
                     Column('d_expires', DateTime(timezone=True), nullable=True),
+                    Column('n', BigInteger, nullable=True),
                     mysql_engine='InnoDB',
                     mysql_charset='utf8mb4')
-        meta.create_all(db.connect(), tables=[tbl])
+        tables = [tbl]
+        self.use_tags = tags
+        if tags:
+            tables.append(
+                Table(f'{table_name}_tags',
+                      meta,
+                      Column('id', VARCHAR(256), nullable=False,
+                             primary_key=True),
+                      Column('tag', VARCHAR(256), nullable=False,
+                             primary_key=True),
+                      Index(f'{table_name}_tags_tag', 'tag'),
+                      mysql_engine='InnoDB',
+                      mysql_charset='utf8mb4'))
+        self.use_streams = streams
+        self.chunk_size = chunk_size
+        if streams:
+            tables.append(
+                Table(f'{table_name}_chunks',
+                      meta,
+                      Column('id', VARCHAR(256), nullable=False,
+                             primary_key=True),
+                      Column('chunk', Integer, nullable=False,
+                             primary_key=True),
+                      Column('content', LargeBinary, nullable=False),
+                      mysql_engine='InnoDB',
+                      mysql_charset='utf8mb4'))
+        meta.create_all(db.connect(), tables=tables)
+        # tables, created by older versions, have no counter column
+        if 'n' not in [
+                c['name']
+                for c in inspect(db.get_engine()).get_columns(table_name)
+        ]:
+            self.db.execute(f'ALTER TABLE {table_name} ADD COLUMN n BIGINT')
+        self.use_upsert = self.db.name in ['sqlite', 'postgresql', 'mysql']
+        if self.db.name == 'sqlite':
+            import sqlite3
+            self.use_returning = sqlite3.sqlite_version_info >= (3, 35)
+        else:
+            self.use_returning = self.db.name == 'postgresql'
+        self.write_behind = write_behind
+        if write_behind:
+            self.flush_interval = flush_interval
+            self.flush_size = flush_size
+            self._wb_buf = {}
+            self._wb_flushing = {}
+            self._wb_lock = threading.Lock()
+            self._wb_flush_lock = threading.RLock()
+            self._wb_event = threading.Event()
+            self._wb_active = True
+            self._wb_flusher = threading.Thread(
+                target=_kv_wb_loop,
+                args=(weakref.ref(self), self._wb_event, flush_interval),
+                name='pyaltt2_kv_flusher',
+                daemon=True)
+            self._wb_flusher.start()
+            _kv_write_behind.add(self)
+
+    def _dq(self, q):
+        return q + '.mysql' if self.db.name == 'mysql' else q
+
+    def _wb_get(self, key):
+        with self._wb_lock:
+            try:
+                return self._wb_buf[key]
+            except KeyError:
+                return self._wb_flushing.get(key)
+
+    def flush(self):
+        """
+        Write buffered objects to the database (write-behind mode)
+
+        If writing fails, objects are returned to the buffer
+        """
+        if not self.write_behind:
+            return
+        with self._wb_flush_lock:
+            with self._wb_lock:
+                if not self._wb_buf:
+                    return
+                self._wb_flushing = self._wb_buf
+                self._wb_buf = {}
+            try:
+                self._put_rows([{
+                    'id': k,
+                    'content': v[0],
+                    'd_expires': v[1],
+                    'tags': v[2]
+                } for k, v in self._wb_flushing.items()])
+            except:
+                with self._wb_lock:
+                    for k, v in self._wb_flushing.items():
+                        self._wb_buf.setdefault(k, v)
+                raise
+            finally:
+                with self._wb_lock:
+                    self._wb_flushing = {}
+
+    def stop(self):
+        """
+        Stop write-behind flusher and flush the buffer
+        """
+        if self.write_behind and self._wb_active:
+            with self._wb_lock:
+                self._wb_active = False
+            _kv_write_behind.discard(self)
+            self._wb_event.set()
+            self._wb_flusher.join()
+            self.flush()
 
     def get(self, key, delete=False):
         """
@@ -299,17 +660,36 @@ class KVStorage:
         Raises:
             LookupError: object not found
         """
-        from msgpack import loads
+        if self.write_behind:
+            buffered = self._wb_get(key)
+            if buffered is not None:
+                if delete:
+                    self.delete(key)
+                return self._decode(buffered[0])
         result = self.db.query('kv.get', qargs=[self.table_name],
                                id=key).fetchone()
         if result:
+            value = self._value(key, result.content, result.n)
             if delete:
                 self.delete(key)
-            return loads(result.content, raw=False)
+            return value
         else:
             raise LookupError
 
-    def put(self, key=None, value=None, expires=None, override=True):
+    def _value(self, key, content, n):
+        if content is None:
+            return n
+        elif _kv_is_stream(content):
+            return b''.join(self._read_chunks(key, content))
+        else:
+            return self._decode(content)
+
+    def put(self,
+            key=None,
+            value=None,
+            expires=None,
+            override=True,
+            tags=None):
         """
         Put object to key-value storage
 
@@ -320,34 +700,983 @@ class KVStorage:
             value: value to put
             expires: expiration either in seconds or datetime.timedelta
             override: replace existing object
+            tags: list of object tags (replace tags of the existing object)
         Returns:
             object key
+        Raises:
+            KeyExistsError: object already exists (if override is False)
         """
-        from msgpack import dumps
+        from sqlalchemy.exc import IntegrityError
+        self._check_tags(tags)
+        value = self._encode(value)
+        d_expires = None if expires is None else _kv_expires(expires)
         if key is None:
             key = gen_random_str(length=64)
-        elif override:
-            try:
-                self.delete(key)
-            except LookupError:
-                pass
-        value = dumps(value)
-        if expires is None:
-            self.db.query('kv.put',
-                          qargs=[self.table_name],
-                          id=key,
-                          content=value)
+        if self.write_behind:
+            if override:
+                self._wb_put({key: (value, d_expires, tags)})
+                return key
+            elif self._wb_get(key) is not None:
+                raise KeyExistsError(key)
+        row = {
+            'id': key,
+            'content': value,
+            'd_expires': d_expires,
+            'tags': tags
+        }
+        if override:
+            self._put_rows([row])
+            return key
+        try:
+            with self.db.connect().begin():
+                self.db.query('kv.put.expires',
+                              qargs=[self.table_name],
+                              id=key,
+                              content=value,
+                              d_expires=d_expires)
+                self._put_tags([row])
+        except IntegrityError:
+            raise KeyExistsError(key)
+        return key
+
+    def _check_tags(self, tags):
+        if tags and not self.use_tags:
+            raise ValueError('tags are not enabled for the storage')
+
+    def get_many(self, keys):
+        """
+        Get multiple objects from key-value storage
+
+        Args:
+            keys: list of object keys
+        Returns:
+            dict key/value of found objects
+        """
+        result = {}
+        keys = list(keys)
+        if self.write_behind:
+            with self._wb_lock:
+                buffered = {**self._wb_flushing, **self._wb_buf}
+        for i in range(0, len(keys), KV_BATCH_SIZE):
+            batch = keys[i:i + KV_BATCH_SIZE]
+            for r in self.db.query(
+                    'kv.get_many',
+                    qargs=[
+                        self.table_name, ', '.join(
+                            f':k{n}' for n in range(len(batch)))
+                    ],
+                    **{f'k{n}': k for n, k in enumerate(batch)}).fetchall():
+                result[r.id] = self._value(r.id, r.content, r.n)
+        if self.write_behind:
+            for k in keys:
+                if k in buffered:
+                    result[k] = self._decode(buffered[k][0])
+        return result
+
+    def put_many(self, data, expires=None, tags=None):
+        """
+        Put multiple objects to key-value storage
+
+        Existing objects are replaced, all objects are put in a single
+        transaction
+
+        Args:
+            data: dict key/value
+            expires: expiration either in seconds or datetime.timedelta
+            tags: list of tags for all objects
+        """
+        self._check_tags(tags)
+        d_expires = None if expires is None else _kv_expires(expires)
+        if self.write_behind:
+            self._wb_put({
+                k: (self._encode(v), d_expires, tags) for k, v in data.items()
+            })
         else:
-            d_expires = datetime.datetime.now() + datetime.timedelta(
-                seconds=expires) if isinstance(
-                    expires, int) else datetime.datetime.now() + expires
-            self.db.query('kv.put.expires',
+            self._put_rows([{
+                'id': k,
+                'content': self._encode(v),
+                'd_expires': d_expires,
+                'tags': tags
+            } for k, v in data.items()])
+
+    def _wb_put(self, data):
+        with self._wb_lock:
+            if self._wb_active:
+                self._wb_buf.update(data)
+                if len(self._wb_buf) >= self.flush_size:
+                    self._wb_event.set()
+                return
+        # the flusher is stopped
+        self._put_rows([{
+            'id': k,
+            'content': v[0],
+            'd_expires': v[1],
+            'tags': v[2]
+        } for k, v in data.items()])
+
+    def _put_rows(self, rows):
+        if not rows:
+            return
+        with self.db.connect().begin():
+            if self.use_upsert:
+                self._execute_many(self._dq('kv.upsert'), rows)
+            else:
+                self._execute_many('kv.delete', rows)
+                self._execute_many('kv.put.expires', rows)
+            self._put_tags(rows)
+            if self.use_streams:
+                self._execute_many('kv.chunks.delete', rows)
+
+    def _put_tags(self, rows):
+        if not self.use_tags:
+            return
+        self._execute_many('kv.tags.delete', rows)
+        tag_rows = [{
+            'id': r['id'],
+            'tag': tag
+        } for r in rows if r['tags'] for tag in set(r['tags'])]
+        if tag_rows:
+            self._execute_many('kv.tags.put', tag_rows)
+
+    def _execute_many(self, q, rows):
+        from sqlalchemy import text as sql
+        self.db.execute(sql(self.db.rq_func(q).format(self.table_name)), rows)
+
+    def incr(self, key, delta=1, expires=None):
+        """
+        Atomically increment counter
+
+        Counter is created if not exists. Done with a single upsert query (plus
+        SELECT in the same transaction for MySQL and SQLite < 3.35). Objects,
+        stored with "put", are not counters and are never overwritten.
+
+        Supported for SQLite, PostgreSQL and MySQL only
+
+        Args:
+            key: counter key
+            delta: integer to add (default: 1)
+            expires: counter expiration (set on creation only), if the counter
+                is expired, it is reset to delta
+        Returns:
+            new counter value
+        Raises:
+            ValueError: the object exists and is not a counter
+        """
+        if not self.use_upsert:
+            raise RuntimeError(f'incr is not supported for {self.db.name}')
+        self.flush()
+        kw = {
+            'id': key,
+            'delta': delta,
+            'd': datetime.datetime.now(),
+            'd_expires': None if expires is None else _kv_expires(expires)
+        }
+        with self.db.connect().begin():
+            if self.use_returning:
+                # no row is returned if the object is not a counter
+                result = self.db.query('kv.incr',
+                                       qargs=[self.table_name, ' RETURNING n'],
+                                       **kw).fetchone()
+            else:
+                self.db.query(self._dq('kv.incr'),
+                              qargs=[self.table_name, ''],
+                              **kw)
+                result = self.db.query('kv.get',
+                                       qargs=[self.table_name],
+                                       id=key).fetchone()
+                if result.content is not None:
+                    result = None
+        if result is None:
+            raise ValueError('object is not a counter')
+        return result.n
+
+    def cas(self, key, expected, value):
+        """
+        Compare-and-set object value
+
+        The current value is compared with the expected one in the encoded form
+        with a single query. Objects must be encoded with the same codec and
+        compression, dicts must have the same key order.
+
+        Args:
+            key: object key
+            expected: expected current value
+            value: new value
+        Returns:
+            True if value is set, False if the current value differs or the
+            object does not exist
+        """
+        self.flush()
+        return self.db.query('kv.cas',
+                             qargs=[self.table_name],
+                             id=key,
+                             expected=self._encode(expected),
+                             content=self._encode(value)).rowcount > 0
+
+    def _scan(self, prefix, page_size, after, fields=''):
+        self.flush()
+        cond = ''
+        kw = {'d': datetime.datetime.now(), 'limit': page_size}
+        if prefix:
+            cond += ' AND id>=:prefix'
+            kw['prefix'] = prefix
+            upper = _kv_prefix_upper(prefix)
+            if upper is not None:
+                cond += ' AND id<:upper'
+                kw['upper'] = upper
+        if after is not None:
+            cond += ' AND id>:after'
+            kw['after'] = after
+        return self.db.query('kv.scan',
+                             qargs=[self.table_name, fields, cond],
+                             **kw).fetchall()
+
+    def scan(self, prefix='', page_size=100, after=None):
+        """
+        List object keys
+
+        Uses range query on the primary key with keyset pagination. Expired
+        objects are skipped. Ranges are calculated in code point order, so the
+        key column should have binary collation.
+
+        Args:
+            prefix: key prefix
+            page_size: max number of keys to return (default: 100)
+            after: return keys after the specified one (use the last key of
+                the previous page to get the next page)
+        Returns:
+            list of keys, ordered
+        """
+        return [r.id for r in self._scan(prefix, page_size, after)]
+
+    def iter_items(self, prefix='', page_size=100):
+        """
+        Iterate over objects
+
+        Objects are fetched by pages, values are decoded only when the item is
+        yielded, so the full storage can be iterated with constant memory.
+
+        Args:
+            prefix: key prefix
+            page_size: page size (default: 100)
+        Returns:
+            generator of (key, value) tuples, ordered by key
+        """
+        after = None
+        while True:
+            rows = self._scan(prefix, page_size, after, fields=', content, n')
+            for r in rows:
+                yield r.id, self._value(r.id, r.content, r.n)
+            if len(rows) < page_size:
+                break
+            after = rows[-1].id
+
+    def _encode(self, value):
+        return kv_encode(value,
+                         codec=self.codec,
+                         compression=self.compression,
+                         compress_min=self.compress_min)
+
+    def _decode(self, data):
+        return kv_decode(data)
+
+    def delete(self, key):
+        """
+        Delete object in key-value storage
+
+        Args:
+            key: object key
+        Raises:
+            LookupError: object not found
+        """
+        buffered = False
+        if self.write_behind:
+            with self._wb_lock:
+                buffered = self._wb_buf.pop(key, None) is not None
+            self.flush()
+        with self.db.connect().begin():
+            if self.use_tags:
+                self.db.query('kv.tags.delete',
+                              qargs=[self.table_name],
+                              id=key)
+            if self.use_streams:
+                self.db.query('kv.chunks.delete',
+                              qargs=[self.table_name],
+                              id=key)
+            if not self.db.query('kv.delete', qargs=[self.table_name],
+                                 id=key).rowcount and not buffered:
+                raise LookupError
+
+    def delete_by_tag(self, tag):
+        """
+        Delete all objects with the specified tag
+
+        Objects are deleted with a single query, write-behind buffer is
+        cleared as well
+
+        Args:
+            tag: object tag
+        Returns:
+            number of deleted objects
+        """
+        if not self.use_tags:
+            raise ValueError('tags are not enabled for the storage')
+        buffered = set()
+        if self.write_behind:
+            with self._wb_lock:
+                for k, v in list(self._wb_buf.items()):
+                    if v[2] and tag in v[2]:
+                        del self._wb_buf[k]
+                        buffered.add(k)
+            self.flush()
+        with self.db.connect().begin():
+            if buffered:
+                # buffered objects, which are stored as well, are counted
+                # by the delete query
+                buffered.difference_update(
+                    r.id for r in self.db.query('kv.ids_by_tag',
+                                                qargs=[self.table_name],
+                                                tag=tag).fetchall())
+            if self.use_streams:
+                self.db.query('kv.chunks.delete_by_tag',
+                              qargs=[self.table_name],
+                              tag=tag)
+            deleted = self.db.query('kv.delete_by_tag',
+                                    qargs=[self.table_name],
+                                    tag=tag).rowcount
+            self.db.query('kv.tags.delete_tag',
                           qargs=[self.table_name],
-                          id=key,
-                          content=value,
-                          d_expires=d_expires)
+                          tag=tag)
+        return deleted + len(buffered)
+
+    def cleanup(self):
+        """
+        Deletes expired objects
+        """
+        self.flush()
+        d = datetime.datetime.now()
+        if self.use_streams:
+            self.db.query('kv.chunks.cleanup', qargs=[self.table_name], d=d)
+        self.db.query('kv.cleanup', qargs=[self.table_name], d=d)
+        if self.use_tags:
+            self.db.query('kv.tags.cleanup', qargs=[self.table_name])
+
+    def put_stream(self, key, data, expires=None, tags=None):
+        """
+        Put large binary object to key-value storage as a chunked stream
+
+        Data is split into chunks of chunk_size, which are compressed (if
+        compression is set) and stored one by one, so the full object is never
+        kept in memory. The existing object is replaced.
+
+        Args:
+            key: string key (1-255 chars)
+            data: iterable of bytes
+            expires: expiration either in seconds or datetime.timedelta
+            tags: list of object tags
+        """
+        if not self.use_streams:
+            raise ValueError('streams are not enabled for the storage')
+        self._check_tags(tags)
+        compression_id = 0
+        compress = None
+        if self.compression:
+            compression_id, compress, _, _ = KV_COMPRESSORS[self.compression]
+        self.flush()
+        row = {
+            'id': key,
+            'content': KV_HEADER + bytes((compression_id << 4 | KV_STREAM,)),
+            'd_expires': None if expires is None else _kv_expires(expires),
+            'tags': tags
+        }
+        with self.db.connect().begin():
+            self.db.query('kv.chunks.delete', qargs=[self.table_name], id=key)
+            chunk = 0
+            buf = bytearray()
+
+            def write(b):
+                nonlocal chunk
+                self.db.query('kv.chunks.put',
+                              qargs=[self.table_name],
+                              id=key,
+                              chunk=chunk,
+                              content=compress(b) if compress else b)
+                chunk += 1
+
+            for d in data:
+                buf += d
+                while len(buf) >= self.chunk_size:
+                    write(bytes(buf[:self.chunk_size]))
+                    del buf[:self.chunk_size]
+            if buf:
+                write(bytes(buf))
+            if self.use_upsert:
+                self.db.query(self._dq('kv.upsert'),
+                              qargs=[self.table_name],
+                              **row)
+            else:
+                self.db.query('kv.delete', qargs=[self.table_name], id=key)
+                self.db.query('kv.put.expires',
+                              qargs=[self.table_name],
+                              **row)
+            self._put_tags([row])
+
+    def get_stream(self, key):
+        """
+        Get object from key-value storage as a stream
+
+        Chunks are fetched from the database one by one
+
+        Args:
+            key: object key
+        Returns:
+            generator of bytes
+        Raises:
+            LookupError: object not found
+            ValueError: object is not a stream or bytes
+        """
+        buffered = self._wb_get(key) if self.write_behind else None
+        if buffered is not None:
+            value = self._decode(buffered[0])
+        else:
+            result = self.db.query('kv.get',
+                                   qargs=[self.table_name],
+                                   id=key).fetchone()
+            if not result:
+                raise LookupError
+            if result.content is not None and _kv_is_stream(result.content):
+                return self._read_chunks(key, result.content)
+            value = self._value(key, result.content, result.n)
+        if not isinstance(value, bytes):
+            raise ValueError('object is not a stream')
+        return iter((value,))
+
+    def _read_chunks(self, key, marker):
+        compression_id = marker[1] >> 4
+        decompress = _kv_compressors_by_id[compression_id][
+            2] if compression_id else None
+        chunk = 0
+        while True:
+            result = self.db.query('kv.chunks.get',
+                                   qargs=[self.table_name],
+                                   id=key,
+                                   chunk=chunk).fetchone()
+            if not result:
+                break
+            yield decompress(result.content) if decompress else bytes(
+                result.content)
+            chunk += 1
+
+
+class ShardedKVStorage:
+    """
+    Key-value storage, sharded over several tables and/or databases
+
+    Keys are mapped to shards with consistent hashing, so adding a new database
+    (to the end of the list) or increasing the number of tables moves only the
+    part of the keys, which belong to the new shards.
+    """
+
+    def __init__(self, db, tables=1, table_name='kv', vnodes=64, **kwargs):
+        """
+        Args:
+            db: pyaltt2.db.Database or list of databases
+            tables: number of storage tables in each database (default: 1)
+            table_name: storage table name or prefix (default: kv, tables are
+                named kv, kv_1, kv_2..., so the existing non-sharded table
+                stays the first shard)
+            vnodes: virtual nodes per shard on hash ring (default: 64)
+            kwargs: passed to KVStorage as-is
+        """
+        if isinstance(db, Database):
+            db = [db]
+        self.shards = []
+        ring = []
+        for i, d in enumerate(db):
+            for t in range(tables):
+                tbl = f'{table_name}_{t}' if t else table_name
+                shard = KVStorage(d, table_name=tbl, **kwargs)
+                self.shards.append(shard)
+                # ring positions depend on shard indexes only, so adding
+                # tables does not move keys between the existing ones
+                for v in range(vnodes):
+                    ring.append((self._hash(f'{i}/{t}/{v}'), shard))
+        ring.sort(key=lambda x: x[0])
+        self._ring_hashes = [r[0] for r in ring]
+        self._ring_shards = [r[1] for r in ring]
+
+    @staticmethod
+    def _hash(s):
+        import hashlib
+        return int.from_bytes(hashlib.md5(s.encode()).digest()[:8], 'big')
+
+    def get_shard(self, key):
+        """
+        Get shard for the key
+
+        Args:
+            key: object key
+        Returns:
+            pyaltt2.db.KVStorage object
+        """
+        from bisect import bisect
+        i = bisect(self._ring_hashes, self._hash(key))
+        return self._ring_shards[i if i < len(self._ring_shards) else 0]
+
+    def get(self, key, delete=False):
+        """
+        Get object from key-value storage
+
+        Args:
+            key: object key
+            delete: delete object after getting
+        Raises:
+            LookupError: object not found
+        """
+        return self.get_shard(key).get(key, delete=delete)
+
+    def put(self,
+            key=None,
+            value=None,
+            expires=None,
+            override=True,
+            tags=None):
+        """
+        Put object to key-value storage
+
+        If no key specified, random 64-char key is generated
+
+        Args:
+            key: string key (1-255 chars)
+            value: value to put
+            expires: expiration either in seconds or datetime.timedelta
+            override: replace existing object
+            tags: list of object tags
+        Returns:
+            object key
+        Raises:
+            KeyExistsError: object already exists (if override is False)
+        """
+        if key is None:
+            key = gen_random_str(length=64)
+        return self.get_shard(key).put(key,
+                                       value,
+                                       expires=expires,
+                                       override=override,
+                                       tags=tags)
+
+    def get_many(self, keys):
+        """
+        Get multiple objects from key-value storage
+
+        Args:
+            keys: list of object keys
+        Returns:
+            dict key/value of found objects
+        """
+        result = {}
+        for shard, shard_keys in self._group(keys).items():
+            result.update(shard.get_many(shard_keys))
+        return result
+
+    def put_many(self, data, expires=None, tags=None):
+        """
+        Put multiple objects to key-value storage
+
+        Args:
+            data: dict key/value
+            expires: expiration either in seconds or datetime.timedelta
+            tags: list of tags for all objects
+        """
+        for shard, shard_keys in self._group(data).items():
+            shard.put_many({k: data[k] for k in shard_keys},
+                           expires=expires,
+                           tags=tags)
+
+    def _group(self, keys):
+        groups = {}
+        for k in keys:
+            groups.setdefault(self.get_shard(k), []).append(k)
+        return groups
+
+    def put_stream(self, key, data, expires=None, tags=None):
+        """
+        Put large binary object to key-value storage as a chunked stream
+
+        Args:
+            key: string key (1-255 chars)
+            data: iterable of bytes
+            expires: expiration either in seconds or datetime.timedelta
+            tags: list of object tags
+        """
+        self.get_shard(key).put_stream(key, data, expires=expires, tags=tags)
+
+    def get_stream(self, key):
+        """
+        Get object from key-value storage as a stream
+
+        Args:
+            key: object key
+        Returns:
+            generator of bytes
+        Raises:
+            LookupError: object not found
+        """
+        return self.get_shard(key).get_stream(key)
+
+    def incr(self, key, delta=1, expires=None):
+        """
+        Atomically increment counter
+
+        Args:
+            key: counter key
+            delta: integer to add (default: 1)
+            expires: counter expiration (set on creation only)
+        Returns:
+            new counter value
+        """
+        return self.get_shard(key).incr(key, delta=delta, expires=expires)
+
+    def cas(self, key, expected, value):
+        """
+        Compare-and-set object value
+
+        Args:
+            key: object key
+            expected: expected current value
+            value: new value
+        Returns:
+            True if value is set, False otherwise
+        """
+        return self.get_shard(key).cas(key, expected, value)
+
+    def delete(self, key):
+        """
+        Delete object in key-value storage
+
+        Args:
+            key: object key
+        Raises:
+            LookupError: object not found
+        """
+        self.get_shard(key).delete(key)
+
+    def scan(self, prefix='', page_size=100, after=None):
+        """
+        List object keys
+
+        Args:
+            prefix: key prefix
+            page_size: max number of keys to return (default: 100)
+            after: return keys after the specified one
+        Returns:
+            list of keys, ordered
+        """
+        from heapq import merge
+        from itertools import islice
+        return list(
+            islice(
+                merge(*[
+                    s.scan(prefix=prefix, page_size=page_size, after=after)
+                    for s in self.shards
+                ]), page_size))
+
+    def iter_items(self, prefix='', page_size=100):
+        """
+        Iterate over objects
+
+        Args:
+            prefix: key prefix
+            page_size: page size per shard (default: 100)
+        Returns:
+            generator of (key, value) tuples, ordered by key
+        """
+        from heapq import merge
+        iters = [
+            s.iter_items(prefix=prefix, page_size=page_size)
+            for s in self.shards
+        ]
+        return merge(*iters, key=lambda x: x[0])
+
+    def cleanup(self):
+        """
+        Deletes expired objects
+
+        Shards are cleaned up in parallel
+        """
+        self._run_all('cleanup')
+
+    def delete_by_tag(self, tag):
+        """
+        Delete all objects with the specified tag
+
+        Shards are processed in parallel
+
+        Args:
+            tag: object tag
+        Returns:
+            number of deleted objects
+        """
+        return sum(self._run_all('delete_by_tag', tag))
+
+    def _run_all(self, method, *args):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as pool:
+            return [
+                f.result() for f in [
+                    pool.submit(getattr(s, method), *args) for s in self.shards
+                ]
+            ]
+
+    def flush(self):
+        """
+        Flush write-behind buffers of all shards
+        """
+        for s in self.shards:
+            s.flush()
+
+    def stop(self):
+        """
+        Stop write-behind flushers of all shards
+        """
+        for s in self.shards:
+            s.stop()
+
+
+class SQLiteKVStorage:
+    """
+    Key-value storage in local SQLite file
+
+    Uses sqlite3 module directly, without SQLAlchemy and pyaltt2.db.Database
+    overhead. The table format is compatible with KVStorage, so the same file
+    can be used by both.
+    """
+
+    # same as SQLAlchemy DateTime for SQLite
+    _dt_format = '%Y-%m-%d %H:%M:%S.%f'
+
+    def __init__(self,
+                 fname,
+                 table_name='kv',
+                 codec='msgpack',
+                 compression='zlib',
+                 compress_min=4096):
+        """
+        Args:
+            fname: database file name
+            table_name: storage table name (default: kv)
+            codec: value codec: msgpack (default), json, pickle or raw (bytes)
+            compression: compress large values: zlib (default), lz4, zstd or
+                None
+            compress_min: compress values larger than (default: 4096 bytes)
+        """
+        _check_kv_codec(codec, compression)
+        self.codec = codec
+        self.compression = compression
+        self.compress_min = compress_min
+        self.fname = os.path.expanduser(fname)
+        self.table_name = table_name
+        self.g = threading.local()
+        self._q_get = f'SELECT content, n FROM {table_name} WHERE id=?'
+        self._q_insert = (f'INSERT INTO {table_name} (id, content, d_expires) '
+                          'VALUES (?, ?, ?)')
+        self._q_replace = (f'INSERT OR REPLACE INTO {table_name} '
+                           '(id, content, d_expires) VALUES (?, ?, ?)')
+        self._q_get_many = (f'SELECT id, content, n FROM {table_name} '
+                            'WHERE id IN ({})')
+        self._q_delete = f'DELETE FROM {table_name} WHERE id=?'
+        self._q_cleanup = f'DELETE FROM {table_name} WHERE d_expires < ?'
+        self._q_incr = (f'INSERT INTO {table_name} (id, n, d_expires) '
+                        'VALUES (:id, :delta, :d_expires) '
+                        'ON CONFLICT (id) DO UPDATE SET content=NULL, '
+                        f'n=CASE WHEN {table_name}.d_expires < :d THEN :delta '
+                        f'ELSE COALESCE({table_name}.n, 0) + :delta END, '
+                        f'd_expires=CASE WHEN {table_name}.d_expires < :d '
+                        f'THEN :d_expires ELSE {table_name}.d_expires END '
+                        f'WHERE {table_name}.content IS NULL '
+                        f'OR {table_name}.d_expires < :d')
+        self._q_cas = (f'UPDATE {table_name} SET content=? '
+                       'WHERE id=? AND content=?')
+        conn = self.connect()
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {table_name} '
+                     '(id VARCHAR(256) NOT NULL PRIMARY KEY, '
+                     'content BLOB, d_expires DATETIME, n BIGINT)')
+        if 'n' not in [
+                c[1]
+                for c in conn.execute(f'pragma table_info({table_name})')
+        ]:
+            conn.execute(f'ALTER TABLE {table_name} ADD COLUMN n BIGINT')
+        import sqlite3
+        self.use_returning = sqlite3.sqlite_version_info >= (3, 35)
+
+    def connect(self):
+        """
+        Get thread-local sqlite3 connection
+        """
+        try:
+            return self.g.conn
+        except AttributeError:
+            import sqlite3
+            conn = sqlite3.connect(self.fname, isolation_level=None)
+            conn.execute('pragma journal_mode=WAL')
+            conn.execute('pragma synchronous=NORMAL')
+            self.g.conn = conn
+            return conn
+
+    def get(self, key, delete=False):
+        """
+        Get object from key-value storage
+
+        Args:
+            key: object key
+            delete: delete object after getting
+        Raises:
+            LookupError: object not found
+        """
+        conn = self.connect()
+        result = conn.execute(self._q_get, (key,)).fetchone()
+        if result:
+            if delete:
+                conn.execute(self._q_delete, (key,))
+            if result[0] is None:
+                return result[1]
+            return kv_decode(result[0])
+        else:
+            raise LookupError
+
+    def put(self, key=None, value=None, expires=None, override=True):
+        """
+        Put object to key-value storage
+
+        If no key specified, random 64-char key is generated
+
+        Args:
+            key: string key (1-255 chars)
+            value: value to put
+            expires: expiration either in seconds or datetime.timedelta
+            override: replace existing object
+        Returns:
+            object key
+        Raises:
+            KeyExistsError: object already exists (if override is False)
+        """
+        import sqlite3
+        if key is None:
+            key = gen_random_str(length=64)
+        d_expires = None if expires is None else _kv_expires(
+            expires).strftime(self._dt_format)
+        try:
+            self.connect().execute(
+                self._q_replace if override else self._q_insert,
+                (key, self._encode(value), d_expires))
+        except sqlite3.IntegrityError:
+            raise KeyExistsError(key)
         return key
 
+    def get_many(self, keys):
+        """
+        Get multiple objects from key-value storage
+
+        Args:
+            keys: list of object keys
+        Returns:
+            dict key/value of found objects
+        """
+        result = {}
+        keys = list(keys)
+        conn = self.connect()
+        for i in range(0, len(keys), KV_BATCH_SIZE):
+            batch = keys[i:i + KV_BATCH_SIZE]
+            for r in conn.execute(
+                    self._q_get_many.format(','.join('?' * len(batch))),
+                    batch):
+                result[r[0]] = r[2] if r[1] is None else kv_decode(r[1])
+        return result
+
+    def put_many(self, data, expires=None):
+        """
+        Put multiple objects to key-value storage
+
+        Existing objects are replaced, all objects are put in a single
+        transaction
+
+        Args:
+            data: dict key/value
+            expires: expiration either in seconds or datetime.timedelta
+        """
+        d_expires = None if expires is None else _kv_expires(
+            expires).strftime(self._dt_format)
+        rows = [(k, self._encode(v), d_expires) for k, v in data.items()]
+        conn = self.connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(self._q_replace, rows)
+
+    def incr(self, key, delta=1, expires=None):
+        """
+        Atomically increment counter
+
+        Counter is created if not exists. Objects, stored with "put", are not
+        counters and are never overwritten.
+
+        Args:
+            key: counter key
+            delta: integer to add (default: 1)
+            expires: counter expiration (set on creation only), if the counter
+                is expired, it is reset to delta
+        Returns:
+            new counter value
+        Raises:
+            ValueError: the object exists and is not a counter
+        """
+        kw = {
+            'id': key,
+            'delta': delta,
+            'd': datetime.datetime.now().strftime(self._dt_format),
+            'd_expires': None if expires is None else
+                         _kv_expires(expires).strftime(self._dt_format)
+        }
+        conn = self.connect()
+        if self.use_returning:
+            # no row is returned if the object is not a counter
+            result = conn.execute(self._q_incr + ' RETURNING n',
+                                  kw).fetchone()
+        else:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute(self._q_incr, kw)
+                content, n = conn.execute(self._q_get, (key,)).fetchone()
+            result = None if content is not None else (n,)
+        if result is None:
+            raise ValueError('object is not a counter')
+        return result[0]
+
+    def cas(self, key, expected, value):
+        """
+        Compare-and-set object value
+
+        The current value is compared with the expected one in the encoded form
+        with a single query. Objects must be encoded with the same codec and
+        compression, dicts must have the same key order.
+
+        Args:
+            key: object key
+            expected: expected current value
+            value: new value
+        Returns:
+            True if value is set, False if the current value differs or the
+            object does not exist
+        """
+        return self.connect().execute(
+            self._q_cas,
+            (self._encode(value), key, self._encode(expected))).rowcount > 0
+
+    def _encode(self, value):
+        return kv_encode(value,
+                         codec=self.codec,
+                         compression=self.compression,
+                         compress_min=self.compress_min)
+
     def delete(self, key):
         """
         Delete object in key-value storage
@@ -357,14 +1686,166 @@ class KVStorage:
         Raises:
             LookupError: object not found
         """
-        if not self.db.query('kv.delete', qargs=[self.table_name],
-                             id=key).rowcount:
+        if not self.connect().execute(self._q_delete, (key,)).rowcount:
             raise LookupError
 
     def cleanup(self):
         """
         Deletes expired objects
         """
-        self.db.query('kv.cleanup',
-                      qargs=[self.table_name],
-                      d=datetime.datetime.now())
+        self.connect().execute(
+            self._q_cleanup,
+            (datetime.datetime.now().strftime(self._dt_format),))
+
+
+class AsyncKVStorage:
+    """
+    asyncio wrapper for key-value storage
+
+    Storage methods are executed in a dedicated thread pool, so the event loop
+    is not blocked during SQL queries. Concurrent gets of the same key are
+    merged into a single query, all merged callers receive the same object.
+    Gets, started after a write of the key, are never merged with the ones
+    started before it.
+
+    The object should be used from a single event loop only.
+    """
+
+    def __init__(self, kv, max_workers=4):
+        """
+        Args:
+            kv: KVStorage, ShardedKVStorage or SQLiteKVStorage
+            max_workers: max storage threads (default: 4)
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        self.kv = kv
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='pyaltt2_kv')
+        self._inflight = {}
+
+    async def _run(self, func, *args, **kwargs):
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(func, *args, **kwargs))
+
+    async def get(self, key, delete=False):
+        """
+        Get object from key-value storage
+
+        Args:
+            key: object key
+            delete: delete object after getting (such gets are never merged)
+        Raises:
+            LookupError: object not found
+        """
+        import asyncio
+        if delete:
+            self._invalidate(key)
+            return await self._run(self.kv.get, key, delete=True)
+        try:
+            fut = self._inflight[key]
+        except KeyError:
+            fut = asyncio.ensure_future(self._run(self.kv.get, key))
+            self._inflight[key] = fut
+            fut.add_done_callback(partial(self._get_done, key))
+        return await asyncio.shield(fut)
+
+    def _get_done(self, key, fut):
+        # the key may be already taken by a newer get
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+
+    def _invalidate(self, key=None):
+        # called before writes, so the next gets start new queries
+        if key is None:
+            self._inflight.clear()
+        else:
+            self._inflight.pop(key, None)
+
+    async def put(self,
+                  key=None,
+                  value=None,
+                  expires=None,
+                  override=True,
+                  **kwargs):
+        """
+        Put object to key-value storage
+
+        Args:
+            key: string key (1-255 chars), random if not specified
+            value: value to put
+            expires: expiration either in seconds or datetime.timedelta
+            override: replace existing object
+            kwargs: passed to storage as-is (e.g. tags)
+        Returns:
+            object key
+        Raises:
+            KeyExistsError: object already exists (if override is False)
+        """
+        self._invalidate(key)
+        return await self._run(self.kv.put,
+                               key,
+                               value,
+                               expires=expires,
+                               override=override,
+                               **kwargs)
+
+    async def delete(self, key):
+        """
+        Delete object in key-value storage
+
+        Args:
+            key: object key
+        Raises:
+            LookupError: object not found
+        """
+        self._invalidate(key)
+        await self._run(self.kv.delete, key)
+
+    async def get_many(self, keys):
+        """
+        Get multiple objects from key-value storage
+
+        Args:
+            keys: list of object keys
+        Returns:
+            dict key/value of found objects
+        """
+        return await self._run(self.kv.get_many, keys)
+
+    async def put_many(self, data, expires=None, **kwargs):
+        """
+        Put multiple objects to key-value storage
+
+        Args:
+            data: dict key/value
+            expires: expiration either in seconds or datetime.timedelta
+            kwargs: passed to storage as-is (e.g. tags)
+        """
+        self._invalidate()
+        await self._run(self.kv.put_many, data, expires=expires, **kwargs)
+
+    async def delete_by_tag(self, tag):
+        """
+        Delete all objects with the specified tag
+
+        Args:
+            tag: object tag
+        Returns:
+            number of deleted objects
+        """
+        self._invalidate()
+        return await self._run(self.kv.delete_by_tag, tag)
+
+    async def cleanup(self):
+        """
+        Deletes expired objects
+        """
+        self._invalidate()
+        await self._run(self.kv.cleanup)
+
+    def close(self):
+        """
+        Shutdown storage thread pool
+        """
+        self.executor.shutdown()
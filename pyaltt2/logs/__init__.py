@@ -0,0 +1,1531 @@
+"""
+Requires neotermcolor
+
+neotermcolor styles:
+
+- logger:10 - debug log message
+- logger:20 - info log message
+- logger:30 - warning log message
+- logger:40 - error log message
+- logger:50 - critical log message
+- logger:exception - exceptions, printed to stdout (w/o logging)
+
+Keeping records in memory requires neotasker library
+"""
+import logging
+import logging.handlers
+import neotermcolor
+import threading
+import time
+import datetime
+import sys
+import os
+import atexit
+import bisect
+import heapq
+import itertools
+import queue
+import random
+
+from collections import OrderedDict
+
+from ..network import parse_host_port
+
+from types import SimpleNamespace
+
+from .common import (config, logger, LOCAL_TZ, _dropped_records,
+                     _dropped_lock, _count_dropped, _compile_pattern)
+from .storage import (LOG_RECORD_OVERHEAD, LOG_COMPACT_MIN, SPILL_INDEX_STEP,
+                      SHARED_CURSOR_DELAY, _MemRecord, _RecordRing,
+                      SharedLogBuffer, LogSpillStore)
+from .formatters import JSONFormatter, _format_json_escaped
+from .handlers import (SYSLOG_TIMEOUT, SYSLOG_RECONNECT_DELAY,
+                       SYSLOG_RECONNECT_DELAY_MAX, SyslogTCPHandler,
+                       BufferedFileHandler)
+from .collector import (MAX_COLLECTOR_FRAME, COLLECTOR_TIMEOUT,
+                        COLLECTOR_RECONNECT_DELAY, CollectorHandler)
+from . import collector as _collector
+
+DEFAULT_LOG_GET = 100
+MAX_LOG_GET = 10000
+
+CLEAN_INTERVAL = 60
+
+# aggregated exceptions, (class, traceback fingerprint): exception info
+_exceptions = OrderedDict()
+
+_exception_log_lock = threading.RLock()
+_log_record_lock = threading.RLock()
+
+_log_records = _RecordRing()
+
+# copy-on-write list of log record subscriptions
+_subscribers = []
+_subscribers_lock = threading.Lock()
+
+
+__data = SimpleNamespace(logger=None,
+                         cleaner=None,
+                         listener=None,
+                         storm=None,
+                         sampler=None,
+                         spill=None,
+                         pipeline=None,
+                         collector_server=None,
+                         shared=None,
+                         handlers=[])
+
+neotermcolor.set_style('logger:10', color='grey', attrs='bold')
+neotermcolor.set_style('logger:20')
+neotermcolor.set_style('logger:30', color='yellow')
+neotermcolor.set_style('logger:40', color='red')
+neotermcolor.set_style('logger:50', color='red', attrs='bold')
+
+neotermcolor.set_style('logger:exception', color='red')
+
+
+class JSysLogHandler(logging.handlers.SysLogHandler):
+
+    def __init__(self, *args, as_json=False, **kwargs):
+        self.as_json = as_json
+        super().__init__(*args, **kwargs)
+
+    def format(self, record):
+        if self.as_json:
+            return _format_json_escaped(self, record)
+        return super().format(record)
+
+
+class JWatchedFileHandler(logging.handlers.WatchedFileHandler):
+
+    def __init__(self, *args, as_json=False, **kwargs):
+        self.as_json = as_json
+        super().__init__(*args, **kwargs)
+
+    def format(self, record):
+        if self.as_json:
+            return _format_json_escaped(self, record)
+        return super().format(record)
+
+
+class StdoutHandler(logging.StreamHandler):
+
+    def __init__(self, as_json=False):
+        self.as_json = as_json
+        super().__init__()
+
+    def emit(self, record):
+        if not config.stdout_ignore or not _is_ignored(record):
+            super().emit(record)
+
+    def format(self, record):
+        r = _format_json_escaped(
+            self, record) if self.as_json else super().format(record)
+        return neotermcolor.colored(
+            r, style='logger:' + str(record.levelno)) if config.colorize else r
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Log sampling filter
+
+    Rules are dicts with fields:
+
+    * mod: module name (None or absent - any)
+    * level: log level (None or absent - any)
+    * rate: share of records to keep (0..1)
+    * mode: random (default) or deterministic (keep every 1/rate-th record)
+
+    The most specific rule is used: module + level, module, level, default.
+    Records, not matched by any rule, are kept. Rules are resolved once per
+    (module, level) pair, and a record, which reaches several handlers, is
+    sampled only once.
+    """
+
+    def __init__(self, rules):
+        """
+        Args:
+            rules: list of sampling rules
+
+        Raises:
+            ValueError: if a rule is invalid
+        """
+        super().__init__()
+        self._rules = {}
+        self._resolved = {}
+        for rule in rules:
+            rate = rule['rate']
+            if not 0 <= rate <= 1:
+                raise ValueError(f'Invalid sampling rate: {rate}')
+            mode = rule.get('mode', 'random')
+            if mode not in ('random', 'deterministic'):
+                raise ValueError(f'Invalid sampling mode: {mode}')
+            # rate, period (0 for random), counter
+            self._rules[(rule.get('mod'), rule.get('level'))] = [
+                rate, 0 if mode == 'random' or not rate else round(1 / rate),
+                0
+            ]
+
+    def filter(self, record):
+        try:
+            return record._sample_pass
+        except AttributeError:
+            record._sample_pass = result = self.check(record.module,
+                                                      record.levelno)
+            return result
+
+    def check(self, mod, level):
+        """
+        Check should the record be kept or not
+
+        Args:
+            mod: record module
+            level: record level
+
+        Returns:
+            True if the record is kept
+        """
+        try:
+            rule = self._resolved[(mod, level)]
+        except KeyError:
+            rule = self._resolve(mod, level)
+        if rule is None:
+            return True
+        rate = rule[0]
+        if rate >= 1:
+            return True
+        elif rate <= 0:
+            result = False
+        elif rule[1]:
+            n = rule[2]
+            rule[2] = n + 1
+            result = n % rule[1] == 0
+        else:
+            result = random.random() < rate
+        if not result:
+            _count_dropped('sampling')
+        return result
+
+    def _resolve(self, mod, level):
+        rules = self._rules
+        for key in ((mod, level), (mod, None), (None, level), (None, None)):
+            rule = rules.get(key)
+            if rule is not None:
+                break
+        self._resolved[(mod, level)] = rule
+        return rule
+
+
+class StormFilter(logging.Filter):
+    """
+    Log storm suppression filter
+
+    Records are keyed by (module, line number, message template or message
+    type for non-string messages). The first "limit" records of each key pass
+    during a time window, the rest are suppressed and counted. When the window
+    is over, the next record of the key (or "flush" method) emits a "message
+    repeated N times" summary.
+
+    The state is bounded by max_keys (the least recently renewed keys are
+    evicted) and is updated without locks, so the counters are approximate
+    under heavy concurrency. Suppressed records are not kept: the state holds
+    the source fields and the last formatted message of the key only, so
+    exception tracebacks and message arguments are released immediately.
+    """
+
+    # LogRecord fields, kept for the summary
+    _record_fields = ('name', 'levelno', 'levelname', 'pathname', 'filename',
+                      'module', 'lineno', 'funcName', 'thread', 'threadName',
+                      'process', 'processName')
+
+    def __init__(self, limit=10, window=60, max_keys=10000):
+        """
+        Args:
+            limit: max records of the same key per window
+            window: window length (seconds)
+            max_keys: max keys to keep the state for
+        """
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._state = {}
+
+    def filter(self, record):
+        try:
+            return record._storm_pass
+        except AttributeError:
+            msg = record.msg
+            # non-string messages (e.g. dicts) may be unhashable, such
+            # records are keyed by the message type
+            record._storm_pass = result = self.check(
+                (record.module, record.lineno,
+                 msg if isinstance(msg, str) else type(msg)), record.created,
+                record)
+            return result
+
+    def check(self, key, t, record):
+        """
+        Count the record and check should it pass or not
+
+        Args:
+            key: record key
+            t: record time
+            record: LogRecord or log record in dict format
+
+        Returns:
+            True if the record passes
+        """
+        state = self._state
+        st = state.get(key)
+        if st is None or t - st[0] >= self.window:
+            if st is not None:
+                # re-insert the key to keep the active ones from eviction
+                state.pop(key, None)
+                if st[2]:
+                    self._summary(st)
+            state[key] = [t, 1, 0, None]
+            if len(state) > self.max_keys:
+                self._evict()
+            return True
+        st[1] += 1
+        if st[1] <= self.limit:
+            return True
+        st[2] += 1
+        summary = st[3]
+        if isinstance(record, dict):
+            if summary is None:
+                st[3] = summary = (False, record.copy())
+            else:
+                summary[1]['msg'] = record['msg']
+        else:
+            if summary is None:
+                st[3] = summary = (True, {
+                    k: getattr(record, k, None)
+                    for k in self._record_fields
+                })
+            summary[1]['msg'] = record.getMessage()
+        _count_dropped('storm')
+        return False
+
+    def flush(self, t=None):
+        """
+        Emit summaries for finished windows and clean up the state
+
+        Args:
+            t: current time (default: now)
+        """
+        if t is None:
+            t = time.time()
+        for key, st in list(self._state.items()):
+            if t - st[0] >= self.window:
+                if self._state.pop(key, None) is not None and st[2]:
+                    self._summary(st)
+
+    def _evict(self):
+        try:
+            st = self._state.pop(next(iter(self._state)))
+        except (KeyError, RuntimeError, StopIteration):
+            return
+        if st[2]:
+            self._summary(st)
+
+    def _summary(self, st):
+        summary, n = st[3], st[2]
+        if summary is None:
+            return
+        is_record, fields = summary
+        msg = f'{fields["msg"]} (message repeated {n} times)'
+        if is_record:
+            r = logging.makeLogRecord(fields)
+            r.msg = msg
+            r.created = time.time()
+            r.msecs = (r.created - int(r.created)) * 1000
+            r._storm_pass = True
+            logging.getLogger(r.name).handle(r)
+        else:
+            r = fields.copy()
+            r['t'] = time.time()
+            r['msg'] = msg
+            _append_record(_MemRecord.from_dict(r))
+
+
+class _FilterPipeline(logging.Filter):
+    """
+    Log record filter pipeline, compiled by init
+
+    Installed on root handlers (or on the async queue handler). Counts
+    metrics, applies sampling and storm suppression, formats the message once
+    (merging args), pre-computes "ignore" rules and feeds log subscribers.
+    The decision is cached in the record, so the pipeline runs once per record
+    for all handlers and for the memory buffer.
+    """
+
+    def __init__(self,
+                 metrics=False,
+                 sampler=None,
+                 storm=None,
+                 ignore=None,
+                 ignore_mods=None):
+        super().__init__()
+        self.metrics = metrics
+        self.sampler = sampler
+        self.storm = storm
+        self.ignore = ignore or None
+        self.ignore_mods = frozenset(ignore_mods or ())
+
+    def filter(self, record):
+        try:
+            return record._pass
+        except AttributeError:
+            pass
+        if self.metrics:
+            _metrics.count(record)
+        if (self.sampler and not self.sampler.filter(record)) or (
+                self.storm and not self.storm.filter(record)):
+            record._pass = False
+            return False
+        msg = record.getMessage()
+        record.msg = msg
+        record.args = None
+        record._ignored = self.is_ignored(msg, record.module)
+        record._pass = True
+        if _subscribers:
+            r = _mem_record(record)
+            if r is not None:
+                _publish(r)
+        return True
+
+    def is_ignored(self, msg, mod):
+        """
+        Check are the record message or module ignored
+        """
+        return (self.ignore is not None and
+                msg.startswith(self.ignore)) or mod in self.ignore_mods
+
+
+__data.pipeline = _FilterPipeline(ignore=config.ignore,
+                                  ignore_mods=config.ignore_mods)
+
+
+def _is_ignored(record):
+    try:
+        return record._ignored
+    except AttributeError:
+        return __data.pipeline.is_ignored(record.getMessage(), record.module)
+
+
+def append(record=None, rd=None, **kwargs):
+    """
+    Append log record to memory cache
+
+    Args:
+        record: log record, or
+        rd: log record in dict format
+        **kwargs: passed to handle_append as-is
+    """
+    if record:
+        # subscribers are fed by the pipeline
+        if __data.pipeline.filter(record):
+            r = _mem_record(record)
+            if r is not None:
+                _store_record(r, **kwargs)
+    elif rd:
+        if __data.sampler and not __data.sampler.check(rd['mod'], rd['l']):
+            return
+        if __data.storm and not __data.storm.check(
+            (rd['mod'], None, rd['msg']), rd['t'], rd):
+            return
+        _append_record(_MemRecord.from_dict(rd), **kwargs)
+
+
+def _mem_record(record):
+    # memory record for the passed LogRecord, None if it is ignored
+    msg = record.getMessage()
+    if msg and (record.levelno >= config.omit_ignore_for_level or
+                not _is_ignored(record)):
+        return _MemRecord(record.created, msg, record.levelno,
+                          record.threadName, record.module, config.host,
+                          config.name)
+
+
+def _append_record(r, **kwargs):
+    msg = r.msg
+    if not msg or (r.l < config.omit_ignore_for_level and
+                   __data.pipeline.is_ignored(msg, r.mod)):
+        return
+    _store_record(r, **kwargs)
+    _publish(r)
+
+
+def _store_record(r, **kwargs):
+    with _log_record_lock:
+        if __data.shared:
+            try:
+                __data.shared.append(r)
+            except Exception:
+                _count_dropped('shared')
+        else:
+            _log_records.append(r)
+        if __data.spill:
+            try:
+                __data.spill.append(r)
+            except Exception:
+                _count_dropped('spill')
+        if config.keep_logmem_records or config.keep_logmem_bytes:
+            _log_records.trim(config.keep_logmem_records,
+                              config.keep_logmem_bytes)
+    if handle_append is not _handle_append_default:
+        handle_append(r.to_dict(), **kwargs)
+
+
+def _publish(r):
+    d = None
+    for sub in _subscribers:
+        if sub._match(r):
+            if d is None:
+                d = r.to_dict()
+            sub._push(d)
+
+
+def handle_append(rd, **kwargs):
+    """
+    Called after record is appended
+
+    Args:
+        rd: log record in dict format
+        **kwargs: got from append as-is
+    """
+
+
+_handle_append_default = handle_append
+
+class _Subscription:
+
+    def __init__(self, level=0, mods=None, pattern=None, queue_size=1000):
+        self.level = level or 0
+        self.mods = frozenset(mods) if mods else None
+        self._search = _compile_pattern(pattern).search if pattern else None
+        self.queue_size = queue_size
+        self.active = True
+        self.dropped = False
+
+    def _match(self, r):
+        return r.l >= self.level and (self.mods is None or r.mod in self.mods
+                                     ) and (self._search is None or
+                                            self._search(r.msg))
+
+    def _push(self, d):
+        if not self._put(d):
+            self.dropped = True
+            self.close()
+
+    def close(self):
+        """
+        Close the subscription
+        """
+        if self.active:
+            self.active = False
+            global _subscribers
+            with _subscribers_lock:
+                _subscribers = [s for s in _subscribers if s is not self]
+            self._wakeup()
+
+
+class LogSubscription(_Subscription):
+    """
+    Synchronous log record subscription
+
+    Iterate the object or call "get" to receive records. If the consumer does
+    not keep up and the queue is full, the subscription is dropped ("dropped"
+    is set to True), iteration stops after the queued records are received.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._q = queue.Queue(self.queue_size)
+
+    def _put(self, r):
+        try:
+            self._q.put_nowait(r)
+            return True
+        except queue.Full:
+            return False
+
+    def _wakeup(self):
+        try:
+            self._q.put_nowait(None)
+        except queue.Full:
+            # the consumer is not waiting
+            pass
+
+    def get(self, timeout=None):
+        """
+        Get the next log record
+
+        Args:
+            timeout: max time to wait (seconds)
+
+        Returns:
+            log record in dict format or None if timed out or the subscription
+            is closed
+        """
+        try:
+            return self._q.get_nowait()
+        except queue.Empty:
+            if not self.active:
+                return None
+        try:
+            return self._q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def __iter__(self):
+        while True:
+            r = self.get()
+            if r is None:
+                if not self.active:
+                    return
+            else:
+                yield r
+
+
+class AsyncLogSubscription(_Subscription):
+    """
+    Asynchronous log record subscription (async iterator)
+
+    The consumer loop is woken up only when it waits for records. If the
+    consumer does not keep up and the queue is full, the subscription is
+    dropped ("dropped" is set to True), iteration stops after the queued
+    records are received.
+    """
+
+    def __init__(self, loop=None, **kwargs):
+        import asyncio
+        from collections import deque
+        super().__init__(**kwargs)
+        self._loop = loop or asyncio.get_running_loop()
+        self._buf = deque()
+        self._event = asyncio.Event()
+        self._waiting = False
+
+    def _put(self, r):
+        if len(self._buf) >= self.queue_size:
+            return False
+        self._buf.append(r)
+        if self._waiting:
+            self._wakeup()
+        return True
+
+    def _wakeup(self):
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # loop is closed
+            pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            try:
+                return self._buf.popleft()
+            except IndexError:
+                pass
+            if not self.active:
+                raise StopAsyncIteration
+            self._event.clear()
+            self._waiting = True
+            try:
+                # re-check to avoid lost wakeups
+                if not self._buf and self.active:
+                    await self._event.wait()
+            finally:
+                self._waiting = False
+
+
+def subscribe(level=0, mods=None, pattern=None, queue_size=1000):
+    """
+    Subscribe to log records
+
+    Subscribers receive records, passed by the logging pipeline (sampling,
+    storm suppression and "ignore" rules), no matter whether they are kept in
+    memory or not, and records, appended with "append". The pipeline is set
+    up by "init", so records are not delivered before it is called. In
+    collector mode, workers receive own records only, subscribe in the
+    collector process to receive records of all workers.
+
+    Records are filtered before being queued. Slow consumers are dropped
+    instead of blocking the logging thread.
+
+    Args:
+        level: minimal log level
+        mods: list of modules (default: all)
+        pattern: regular expression to search in messages
+        queue_size: max queued records (default: 1000)
+
+    Returns:
+        LogSubscription object
+    """
+    return _subscribe(
+        LogSubscription(level=level,
+                        mods=mods,
+                        pattern=pattern,
+                        queue_size=queue_size))
+
+
+def subscribe_async(level=0,
+                    mods=None,
+                    pattern=None,
+                    queue_size=1000,
+                    loop=None):
+    """
+    Subscribe to log records with async iterator (see "subscribe")
+
+    Args:
+        level: minimal log level
+        mods: list of modules (default: all)
+        pattern: regular expression to search in messages
+        queue_size: max queued records (default: 1000)
+        loop: consumer event loop (default: the running one)
+
+    Returns:
+        AsyncLogSubscription object
+    """
+    return _subscribe(
+        AsyncLogSubscription(level=level,
+                             mods=mods,
+                             pattern=pattern,
+                             queue_size=queue_size,
+                             loop=loop))
+
+
+def _subscribe(sub):
+    global _subscribers
+    with _subscribers_lock:
+        _subscribers = _subscribers + [sub]
+    return sub
+
+
+def unsubscribe(sub):
+    """
+    Close log record subscription
+
+    Args:
+        sub: subscription object
+    """
+    sub.close()
+
+
+def get(level=0, t=0, n=None, pattern=None, after=None):
+    """
+    Get recent log records
+
+    Args:
+        level: minimal log level
+        t: get entries for the recent t seconds
+        n: max number of log records (default: 100)
+        pattern: regular expression to search in messages
+        after: get records with id greater than specified (the oldest ones
+            first, use the last record id as cursor for the next call)
+
+    If the spill store is enabled, records, expired from memory, are read from
+    it. If the shared memory buffer is used, records of all processes are
+    returned. If logs are initialized with the collector, records are
+    requested from it (an empty list is returned if the collector is
+    unavailable).
+    """
+    if config.collector:
+        return _collector.query(config.collector,
+                                level=level,
+                                t=t,
+                                n=n,
+                                pattern=pattern,
+                                after=after)
+    lr = []
+    if n is None:
+        n = DEFAULT_LOG_GET
+    if n > MAX_LOG_GET:
+        n = MAX_LOG_GET
+    ll = 0 if level is None else level
+    shared = __data.shared
+    if shared:
+        if config.keep_logmem and (not t or t > config.keep_logmem):
+            t = config.keep_logmem
+        return [
+            r.to_dict()
+            for r in shared.get(level=ll, t=t, n=n, pattern=pattern,
+                                after=after)
+        ]
+    spill = __data.spill
+    with _log_record_lock:
+        snap = _log_records.snapshot()
+        spill_snap = spill.snapshot() if spill else None
+    recs = snap.records
+    base = snap.base
+    # first record id
+    lo = base + snap.start
+    ram_lo = lo
+    # first record id in spill store
+    spill_lo = spill.first_id(spill_snap) if spill else lo
+    if t:
+        t_min = time.time() - t
+        lo = max(
+            lo, base + bisect.bisect_right(snap.times, t_min, snap.start,
+                                           snap.end))
+        if lo > ram_lo or not spill:
+            spill_lo = ram_lo
+        else:
+            spill_lo = spill.id_for_time(spill_snap, t_min)
+    if after is not None:
+        lo = max(lo, after + 1)
+        spill_lo = max(spill_lo, after + 1)
+    rgx = _compile_pattern(pattern).search if pattern else None
+    if all(lv >= ll for lv in snap.levels):
+        ids = range(lo, base + snap.end)
+        if after is None:
+            ids = reversed(ids)
+    else:
+        ranges = []
+        for lv, (lids, lend) in snap.levels.items():
+            if lv >= ll:
+                idx = range(bisect.bisect_left(lids, lo, 0, lend), lend)
+                ranges.append(
+                    map(lids.__getitem__,
+                        idx if after is not None else reversed(idx)))
+        ids = heapq.merge(*ranges, reverse=after is None)
+    records = map(lambda i: recs[i - base], ids)
+    if spill and spill_lo < ram_lo:
+        spill_records = spill.records(spill_snap,
+                                      spill_lo,
+                                      ram_lo,
+                                      reverse=after is None,
+                                      level=ll)
+        records = itertools.chain(
+            *((spill_records, records) if after is not None else
+              (records, spill_records)))
+    for r in records:
+        if rgx is None or rgx(r.msg):
+            lr.append(r.to_dict())
+            if len(lr) >= n:
+                break
+    return lr if after is not None else list(reversed(lr))
+
+
+async def clean(**kwargs):
+    """
+    Clean obsolete log records from memory
+
+    Usually executed from log cleaner worker (see "start")
+    """
+    logger.debug('Cleaning logs')
+    if __data.storm:
+        __data.storm.flush()
+    with _log_record_lock:
+        _log_records.expire(time.time() - config.keep_logmem)
+        if __data.spill:
+            __data.spill.cleanup()
+            __data.spill.flush()
+
+
+# handler emit latency histogram buckets (seconds)
+METRICS_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05,
+                   0.1, 0.5, 1)
+
+
+class _LogMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.levels = {}
+            self.modules = {}
+            # handler name: [bucket counters, sum, count]
+            self.handlers = {}
+
+    def count(self, record):
+        with self.lock:
+            levels = self.levels
+            modules = self.modules
+            levels[record.levelno] = levels.get(record.levelno, 0) + 1
+            modules[record.module] = modules.get(record.module, 0) + 1
+
+    def observe(self, name, duration):
+        i = bisect.bisect_left(METRICS_BUCKETS, duration)
+        with self.lock:
+            try:
+                h = self.handlers[name]
+            except KeyError:
+                h = [[0] * (len(METRICS_BUCKETS) + 1), 0, 0]
+                self.handlers[name] = h
+            h[0][i] += 1
+            h[1] += duration
+            h[2] += 1
+
+
+_metrics = _LogMetrics()
+
+
+def _timed_emit(name, emit):
+
+    def timed_emit(record):
+        t = time.perf_counter()
+        try:
+            emit(record)
+        finally:
+            _metrics.observe(name, time.perf_counter() - t)
+
+    return timed_emit
+
+
+def metrics():
+    """
+    Get log metrics
+
+    Records and handler metrics are collected if logs are initialized with
+    metrics=True
+
+    Returns:
+        dict with fields: records (by level name and by module), handlers
+        (emit latency histograms with cumulative buckets, sum and count of
+        calls, seconds), dropped (dropped record counters)
+    """
+    with _metrics.lock:
+        levels = _metrics.levels.copy()
+        modules = _metrics.modules.copy()
+        handlers = {
+            name: (h[0].copy(), h[1], h[2])
+            for name, h in _metrics.handlers.items()
+        }
+    with _dropped_lock:
+        dropped = _dropped_records.copy()
+    result = {
+        'records': {
+            'level': {
+                logging.getLevelName(lv): c
+                for lv, c in sorted(levels.items())
+            },
+            'module': modules
+        },
+        'handlers': {},
+        'dropped': dropped
+    }
+    for name, (buckets, total, count) in handlers.items():
+        cumulative = list(itertools.accumulate(buckets))
+        result['handlers'][name] = {
+            'buckets': dict(
+                zip(METRICS_BUCKETS + (float('inf'),), cumulative)),
+            'sum': total,
+            'count': count
+        }
+    return result
+
+
+def _prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def metrics_prometheus(prefix='pyaltt2_logs'):
+    """
+    Get log metrics in Prometheus text exposition format
+
+    Args:
+        prefix: metric name prefix
+
+    Returns:
+        metrics text
+    """
+    m = metrics()
+    lines = []
+
+    def metric(name, kind, help_text, values):
+        lines.append(f'# HELP {prefix}_{name} {help_text}')
+        lines.append(f'# TYPE {prefix}_{name} {kind}')
+        for suffix, labels, value in values:
+            lbl = ','.join(
+                f'{k}="{_prometheus_label(v)}"' for k, v in labels.items())
+            lines.append(f'{prefix}_{name}{suffix}{{{lbl}}} {value}'
+                         if lbl else f'{prefix}_{name}{suffix} {value}')
+
+    metric('records_total', 'counter', 'Log records by level',
+           [('', {
+               'level': lv
+           }, c) for lv, c in m['records']['level'].items()])
+    metric('module_records_total', 'counter', 'Log records by module',
+           [('', {
+               'module': mod
+           }, c) for mod, c in m['records']['module'].items()])
+    values = []
+    for name, h in m['handlers'].items():
+        for le, c in h['buckets'].items():
+            values.append(('_bucket', {
+                'handler': name,
+                'le': '+Inf' if le == float('inf') else repr(le)
+            }, c))
+        values.append(('_sum', {'handler': name}, h['sum']))
+        values.append(('_count', {'handler': name}, h['count']))
+    metric('handler_emit_seconds', 'histogram', 'Log handler emit latency',
+           values)
+    metric('dropped_records_total', 'counter', 'Dropped log records',
+           [('', {
+               'reason': k
+           }, c) for k, c in m['dropped'].items()])
+    return '\n'.join(lines) + '\n'
+
+
+class _RecordQueue(queue.Queue):
+
+    def drop(self, level=None):
+        """
+        Drop the oldest record with level <= specified (any if None)
+
+        Returns:
+            True if record is dropped
+        """
+        with self.mutex:
+            for r in self.queue:
+                if r is not None and (level is None or r.levelno <= level):
+                    self.queue.remove(r)
+                    self.unfinished_tasks -= 1
+                    self.not_full.notify()
+                    return True
+        return False
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue front-end for log handlers
+
+    Overflow policies:
+
+    * block: wait until queue has free space
+    * drop_oldest: drop the oldest queued record
+    * drop_debug: drop the oldest queued DEBUG record (the new one if it is
+      DEBUG), the oldest record if there are no DEBUG records in queue
+    """
+
+    def __init__(self, q, overflow='block'):
+        if overflow not in ('block', 'drop_oldest', 'drop_debug'):
+            raise ValueError(f'Invalid overflow policy: {overflow}')
+        self.overflow = overflow
+        super().__init__(q)
+
+    def prepare(self, record):
+        # records are not pickled, so only the message is merged with args
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                if self.overflow == 'drop_debug':
+                    if record.levelno <= logging.DEBUG:
+                        _count_dropped('queue')
+                        return
+                    if self.queue.drop(logging.DEBUG):
+                        _count_dropped('queue')
+                        continue
+                if self.queue.drop():
+                    _count_dropped('queue')
+
+
+class _QueueListener(logging.handlers.QueueListener):
+
+    def enqueue_sentinel(self):
+        self.queue.put(None)
+
+
+class MemoryLogHandler(logging.Handler):
+
+    def emit(self, record):
+        append(record)
+
+
+class DummyHandler(logging.StreamHandler):
+
+    def emit(self, record):
+        pass
+
+
+def _exception_fingerprint(cn, tb):
+    frames = []
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        frames.append((code.co_filename, tb.tb_lineno, code.co_name))
+        tb = tb.tb_next
+    return (cn, tuple(frames))
+
+
+def log_traceback(display=False,
+                  use_ignore=False,
+                  force=False,
+                  e=None,
+                  critical=False):
+    """
+    Log exception traceback
+
+    The traceback is formatted only if it is logged, displayed or stored.
+    Stored exceptions are aggregated by class and traceback fingerprint (see
+    "serialize_exceptions")
+
+    Args:
+        display: display traceback instead of logging
+        use_ignore: use ignore symbol for traceback string
+        force: force log, even if tracebacks are disabled
+        e: exception or exc_info to log (optional)
+    """
+    log = (config.tracebacks or force) and not display
+    if not log and not display and not config.keep_exceptions:
+        return
+    import traceback
+    if e is None:
+        exc_info = sys.exc_info()
+    elif isinstance(e, tuple):
+        exc_info = e
+    elif e.__traceback__ is not None:
+        exc_info = (e.__class__, e, e.__traceback__)
+    else:
+        exc_info = (None, e, None)
+    exc = exc_info[1]
+    if exc is None:
+        msg = None
+        cn = None
+    else:
+        msg = str(exc)
+        cn = exc.__class__.__name__
+    trace = None
+
+    def format_trace():
+        if exc_info[2] is None:
+            return traceback.format_exc()
+        else:
+            return ''.join(traceback.format_exception(*exc_info))
+
+    if log or display:
+        trace = format_trace()
+        if log:
+            pfx = config.ignore if use_ignore and config.ignore else ''
+            if critical:
+                logging.critical(pfx + trace if trace else msg)
+            else:
+                logging.error(pfx + trace if trace else msg)
+        else:
+            print(
+                neotermcolor.colored(trace if trace else msg,
+                                     style='logger:exception'))
+    if config.keep_exceptions:
+        t = datetime.datetime.now()
+        if LOCAL_TZ:
+            t = t.replace(tzinfo=LOCAL_TZ)
+        t = t.isoformat()
+        level = 'CRITICAL' if critical else 'ERROR'
+        key = _exception_fingerprint(cn, exc_info[2])
+        with _exception_log_lock:
+            try:
+                e = _exceptions[key]
+            except KeyError:
+                e = None
+            if e is None:
+                _exceptions[key] = {
+                    't': t,
+                    'first_t': t,
+                    'count': 1,
+                    'e': {
+                        'class': cn,
+                        'msg': msg,
+                        'trace': trace if trace is not None else format_trace()
+                    },
+                    'l': level
+                }
+                while len(_exceptions) > config.keep_exceptions:
+                    _exceptions.popitem(last=False)
+            else:
+                _exceptions.move_to_end(key)
+                e['t'] = t
+                e['count'] += 1
+                e['e']['msg'] = msg
+                if critical:
+                    e['l'] = level
+
+
+def set_debug(debug=False):
+    """
+    Set debug mode ON/OFF
+
+    Args:
+        debug: True = ON, False = OFF
+    """
+    level = 10 if debug else config.level
+    logging.basicConfig(level=level)
+    if __data.logger:
+        __data.logger.setLevel(level)
+
+
+def serialize():
+    """
+    Get dict with internal data
+    """
+    exceptions = serialize_exceptions()
+    with _dropped_lock:
+        dropped = _dropped_records.copy()
+    return {'exceptions': exceptions, 'dropped_records': dropped}
+
+
+def serialize_exceptions():
+    """
+    Get stored exceptions
+
+    Exceptions with the same class and traceback fingerprint are aggregated:
+    "count" field contains the number of occurrences, "first_t" and "t" -
+    first and last occurrence time, "e.msg" - the last exception message.
+
+    Returns:
+        list of aggregated exceptions, the most recent last
+    """
+    with _exception_log_lock:
+        return [
+            dict(e, e=e['e'].copy()) for e in _exceptions.values()
+        ]
+
+
+def start_collector(path):
+    """
+    Start log collector in the current process
+
+    The collector receives records from worker processes (initialized with
+    collector=path) and handles them with the local log handlers (file,
+    syslog, memory etc.), so "get" in any worker returns the merged log.
+    Requires msgpack.
+
+    Args:
+        path: unix socket path
+    """
+    stop_collector()
+    __data.collector_server = _collector.serve(path, get)
+
+
+def stop_collector():
+    """
+    Stop log collector, started in the current process
+    """
+    server = __data.collector_server
+    if server:
+        __data.collector_server = None
+        server.shutdown()
+        server.server_close()
+        try:
+            os.unlink(server.server_address)
+        except (FileNotFoundError, TypeError):
+            pass
+
+
+def _run_collector(path, kwargs, ready):
+    init(**kwargs)
+    start_collector(path)
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+
+def spawn_collector(path, **kwargs):
+    """
+    Start log collector in a separate daemon process
+
+    E.g. call it in gunicorn master ("on_starting" hook) and initialize
+    logs in workers with collector=path ("post_fork" hook)
+
+    Args:
+        path: unix socket path
+        **kwargs: collector logs init args
+
+    Returns:
+        multiprocessing.Process object
+
+    Raises:
+        RuntimeError: if the collector is not started
+    """
+    import multiprocessing
+    ready = multiprocessing.Event()
+    p = multiprocessing.Process(target=_run_collector,
+                                args=(path, kwargs, ready),
+                                name='pyaltt2:logs:collector',
+                                daemon=True)
+    p.start()
+    if not ready.wait(COLLECTOR_TIMEOUT):
+        p.terminate()
+        raise RuntimeError('Unable to start log collector')
+    return p
+
+
+def init(**kwargs):
+    """
+    Initialize logger
+
+    Args:
+        name: software product name
+        host: custom host name
+        log_file: file to log to
+        log_file_buffer: buffer log file writes (bytes, see
+            BufferedFileHandler), if not set, records are written immediately
+            (rotation does not enable buffering)
+        log_file_flush_interval: flush the log file buffer and check the file
+            for external rotation every N seconds (default: 1)
+        log_file_max_bytes: rotate the log file when it reaches the size
+        log_file_backups: number of rotated log files to keep (default: 5)
+        log_file_compress: gzip rotated log files (default: True)
+        log_stdout: 0 - do not log, 1 - log, 2 - log auto (if no more log hdlrs)
+        syslog: True for /dev/log, socket path, host[:port] or
+            tcp://host[:port] (RFC 5424 via TCP, see SyslogTCPHandler)
+        syslog_queue_size: max records in TCP syslog queue (default: 10000)
+        syslog_batch: max records sent to TCP syslog at once (default: 100)
+        level: log level (default: 20)
+        tracebacks: log tracebacks (default: False)
+        ignore: use "ignore" symbol - memory hdlr ignores records starting with
+        ignore_mods: list of modules to ignore
+        omit_ignore_for_level: omit ignore props for >= level
+        stdout_ignore: use "ignore" symbol in stdout logger as well
+        keep_logmem: keep log records in memory for the specified time (seconds)
+        keep_logmem_records: max number of log records in memory
+        keep_logmem_bytes: max approximate size of log records in memory
+        logmem_spill_dir: spill in-memory log records to disk store in the
+            specified directory (requires msgpack)
+        logmem_spill_segment: spill store segment size (default: 16 MiB)
+        keep_logmem_spill: keep spilled records for the specified time
+            (seconds, 0 - no limit)
+        keep_logmem_spill_bytes: max total size of spill store segments
+        logmem_shared: keep log records in shared memory block with the
+            specified name, visible for all processes (requires msgpack)
+        logmem_shared_workers: max processes for a new shared block (64)
+        logmem_shared_slots: record slots per process for a new shared block
+            (1024)
+        logmem_shared_slot_size: slot size for a new shared block (256 bytes)
+        keep_exceptions: keep number of recent exceptions (aggregated)
+        colorize: colorize stdout if possible
+        formatter: log formatter (use JSONFormatter for structured records)
+        syslog_formatter: if defined, use custom formatter for syslog
+        log_json: true/false
+        syslog_json: true/false
+        async_handlers: process records in a background thread
+        async_queue_size: max records in async queue (default: 10000)
+        async_overflow: async queue overflow policy: block (default),
+            drop_oldest, drop_debug
+        metrics: collect log metrics (see "metrics")
+        collector: send records to the log collector at the specified unix
+            socket path instead of local handlers (see "start_collector")
+        storm_limit: suppress log storms: pass max N records with the same
+            module, line and message template per window (0 - disabled)
+        storm_window: storm suppression window (default: 60 seconds)
+        storm_keys: max keys for storm suppression state (default: 10000)
+        sampling: list of log sampling rules (see SamplingFilter)
+    """
+    for k, v in kwargs.items():
+        if not hasattr(config, k):
+            raise AttributeError('Invalid argument: {}'.format(k))
+        setattr(config, k, v)
+
+    __data.sampler = SamplingFilter(
+        config.sampling) if config.sampling else None
+    __data.storm = StormFilter(
+        limit=config.storm_limit,
+        window=config.storm_window,
+        max_keys=config.storm_keys) if config.storm_limit else None
+    # sampling goes first, so sampled out records are not counted by storm
+    # suppression
+    __data.pipeline = _FilterPipeline(metrics=config.metrics,
+                                      sampler=__data.sampler,
+                                      storm=__data.storm,
+                                      ignore=config.ignore,
+                                      ignore_mods=config.ignore_mods)
+
+    logging.basicConfig(level=config.level)
+    logging.getLogger().setLevel(level=config.level)
+
+    __data.logger = logging.getLogger()
+    for h in __data.logger.handlers.copy():
+        __data.logger.removeHandler(h)
+    _stop_listener()
+    # close handlers of the previous init (stops their threads and closes
+    # files/connections), foreign handlers are only removed
+    for h in __data.handlers:
+        h.close()
+    _close_spill()
+    if __data.shared:
+        with _log_record_lock:
+            __data.shared.close()
+            __data.shared = None
+    if config.keep_logmem and config.logmem_shared and not config.collector:
+        shared = SharedLogBuffer(config.logmem_shared,
+                                 partitions=config.logmem_shared_workers,
+                                 slots=config.logmem_shared_slots,
+                                 slot_size=config.logmem_shared_slot_size)
+        shared.claim()
+        __data.shared = shared
+    elif config.keep_logmem and config.logmem_spill_dir and \
+            not config.collector:
+        spill = LogSpillStore(config.logmem_spill_dir,
+                              segment_size=config.logmem_spill_segment,
+                              max_age=config.keep_logmem_spill,
+                              max_bytes=config.keep_logmem_spill_bytes)
+        with _log_record_lock:
+            if spill.next_id > _log_records.base + len(_log_records.records):
+                # continue record ids after restart
+                _log_records.clear(base=spill.next_id)
+            __data.spill = spill
+    handlers = []
+    has_handler = False
+    if config.collector:
+        has_handler = True
+        handlers.append(CollectorHandler(config.collector))
+    else:
+        if config.log_file:
+            has_handler = True
+            if config.log_file_buffer or config.log_file_max_bytes:
+                handler = BufferedFileHandler(
+                    config.log_file,
+                    buffer_size=config.log_file_buffer,
+                    flush_interval=config.log_file_flush_interval,
+                    max_bytes=config.log_file_max_bytes,
+                    backup_count=config.log_file_backups,
+                    compress=config.log_file_compress,
+                    as_json=config.log_json)
+            else:
+                handler = JWatchedFileHandler(config.log_file,
+                                              as_json=config.log_json)
+            handler.setFormatter(config.formatter)
+            handlers.append(handler)
+        if config.keep_logmem:
+            handler = MemoryLogHandler()
+            handlers.append(handler)
+        if config.syslog:
+            has_handler = True
+            syslog = config.syslog
+            syslog_tcp = syslog is not True and syslog.startswith('tcp://')
+            if syslog_tcp:
+                syslog = syslog[6:]
+            if syslog is True:
+                syslog_addr = '/dev/log'
+            elif syslog.startswith('/') and not syslog_tcp:
+                syslog_addr = syslog
+            else:
+                addr, port = parse_host_port(syslog, 514)
+                if addr:
+                    syslog_addr = (addr, port)
+                else:
+                    logging.error('Invalid syslog configuration: {}'.format(
+                        config.syslog))
+                    syslog_addr = None
+            if syslog_addr and syslog_tcp:
+                handler = SyslogTCPHandler(syslog_addr,
+                                           queue_size=config.syslog_queue_size,
+                                           batch_size=config.syslog_batch,
+                                           as_json=config.syslog_json)
+            elif syslog_addr:
+                handler = JSysLogHandler(address=syslog_addr,
+                                         as_json=config.syslog_json)
+            if syslog_addr:
+                handler.setFormatter(config.syslog_formatter if config.
+                                     syslog_formatter else config.formatter)
+                handlers.append(handler)
+        if (not has_handler and config.log_stdout == 2) or \
+                config.log_stdout is True or config.log_stdout == 1:
+            has_handler = True
+            handler = StdoutHandler(as_json=config.log_json)
+            handler.setFormatter(config.formatter)
+            handlers.append(handler)
+    if not has_handler:
+        # mute all logs
+        handlers.append(DummyHandler())
+    __data.handlers = handlers
+    if config.metrics:
+        names = set()
+        for h in handlers:
+            name = h.name or h.__class__.__name__
+            i = 1
+            while name in names:
+                i += 1
+                name = f'{h.name or h.__class__.__name__}{i}'
+            names.add(name)
+            h.emit = _timed_emit(name, h.emit)
+    if config.async_handlers:
+        q = _RecordQueue(config.async_queue_size)
+        handler = AsyncQueueHandler(q, overflow=config.async_overflow)
+        handler.addFilter(__data.pipeline)
+        __data.logger.addHandler(handler)
+        __data.listener = _QueueListener(q,
+                                         *handlers,
+                                         respect_handler_level=True)
+        __data.listener.start()
+    else:
+        for h in handlers:
+            h.addFilter(__data.pipeline)
+            __data.logger.addHandler(h)
+
+
+def _stop_listener():
+    if __data.listener:
+        __data.listener.stop()
+        __data.listener = None
+
+
+atexit.register(_stop_listener)
+
+
+def _close_spill():
+    with _log_record_lock:
+        if __data.spill:
+            __data.spill.close()
+            __data.spill = None
+
+
+atexit.register(_close_spill)
+
+
+def flush():
+    """
+    Wait until records in async queue are processed and flush log handlers
+    """
+    if __data.listener:
+        __data.listener.queue.join()
+        handlers = __data.listener.handlers
+    elif __data.logger:
+        handlers = __data.logger.handlers
+    else:
+        handlers = []
+    for h in handlers:
+        h.flush()
+
+
+def start(loop=None):
+    """
+    Start log cleaner
+
+    Requires neotasker module, task supervisor must be started before
+
+    Args:
+        loop: neotasker async loop to execute cleaner worker in
+    """
+    import neotasker
+    __data.cleaner = neotasker.BackgroundIntervalWorker(
+        name='pyaltt2:logs:cleaner', delay=CLEAN_INTERVAL, loop=loop)
+    __data.cleaner.run = clean
+    __data.cleaner.start()
+
+
+def stop():
+    """
+    Optional method to stop log cleaner
+    """
+    if __data.cleaner:
+        __data.cleaner.stop()
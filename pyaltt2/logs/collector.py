@@ -0,0 +1,206 @@
+"""
+Log collector transport: the handler and the server request handler
+"""
+import logging
+import struct
+import time
+
+from .common import _count_dropped
+
+
+_FRAME_HEADER = struct.Struct('<I')
+
+# max collector frame size
+MAX_COLLECTOR_FRAME = 64 * 1024 * 1024
+
+# collector connection/query timeout (seconds)
+COLLECTOR_TIMEOUT = 5
+
+# delay before re-connecting to the collector after a failure (seconds)
+COLLECTOR_RECONNECT_DELAY = 1
+
+_exc_formatter = logging.Formatter()
+
+
+def _send_frame(sock, data):
+    import msgpack
+    payload = msgpack.packb(data, default=str)
+    sock.sendall(_FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(rfile, n):
+    data = rfile.read(n)
+    if len(data) < n:
+        raise EOFError
+    return data
+
+
+def _recv_frame(rfile):
+    import msgpack
+    n, = _FRAME_HEADER.unpack(_recv_exact(rfile, _FRAME_HEADER.size))
+    if n > MAX_COLLECTOR_FRAME:
+        raise ValueError(f'Frame too large: {n}')
+    return msgpack.unpackb(_recv_exact(rfile, n))
+
+
+def _pack_record(record):
+    d = {
+        k: v
+        for k, v in record.__dict__.items()
+        if k not in ('msg', 'args', 'exc_info', 'message') and
+        not k.startswith('_')
+    }
+    d['msg'] = record.getMessage()
+    if record.exc_info and not record.exc_text:
+        d['exc_text'] = _exc_formatter.formatException(record.exc_info)
+    return d
+
+
+class CollectorHandler(logging.Handler):
+    """
+    Sends log records to the log collector via unix socket
+
+    Messages are merged with args, exceptions are formatted before sending.
+    If the collector is unavailable, records are dropped and counted, the
+    handler re-connects after COLLECTOR_RECONNECT_DELAY.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: collector socket path
+        """
+        super().__init__()
+        self.path = path
+        self.sock = None
+        self.failed = 0
+
+    def _connect(self):
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(COLLECTOR_TIMEOUT)
+        try:
+            sock.connect(self.path)
+        except:
+            sock.close()
+            raise
+        self.sock = sock
+
+    def emit(self, record):
+        if self.sock is None:
+            if time.monotonic() - self.failed < COLLECTOR_RECONNECT_DELAY:
+                _count_dropped('collector')
+                return
+            try:
+                self._connect()
+            except OSError:
+                self.failed = time.monotonic()
+                _count_dropped('collector')
+                return
+        try:
+            _send_frame(self.sock, {'r': _pack_record(record)})
+        except OSError:
+            self.close_socket()
+            self.failed = time.monotonic()
+            _count_dropped('collector')
+        except Exception:
+            self.handleError(record)
+
+    def close_socket(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def close(self):
+        self.acquire()
+        try:
+            self.close_socket()
+        finally:
+            self.release()
+        super().close()
+
+
+def query(path, **kwargs):
+    """
+    Get log records from the collector
+
+    Args:
+        path: collector socket path
+        **kwargs: logs.get args
+
+    Returns:
+        list of log record dicts (empty if the collector is unavailable)
+    """
+    import socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(COLLECTOR_TIMEOUT)
+            sock.connect(path)
+            _send_frame(sock, {'q': kwargs})
+            with sock.makefile('rb') as rfile:
+                return _recv_frame(rfile)['r']
+    except (OSError, EOFError):
+        # the collector is unavailable, same as the handler drops records
+        return []
+
+
+def _request_handler(get):
+    import socketserver
+
+    class CollectorRequestHandler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            while True:
+                try:
+                    frame = _recv_frame(self.rfile)
+                except (EOFError, OSError, ValueError):
+                    return
+                if 'r' in frame:
+                    record = logging.makeLogRecord(frame['r'])
+                    logging.getLogger(record.name).handle(record)
+                elif 'q' in frame:
+                    q = frame['q']
+                    _send_frame(
+                        self.connection, {
+                            'r':
+                                get(level=q.get('level', 0),
+                                    t=q.get('t', 0),
+                                    n=q.get('n'),
+                                    pattern=q.get('pattern'),
+                                    after=q.get('after'))
+                        })
+
+    return CollectorRequestHandler
+
+
+def serve(path, get):
+    """
+    Start collector server in a background thread
+
+    Args:
+        path: unix socket path (removed if exists)
+        get: function to query log records with
+
+    Returns:
+        server object
+    """
+    import os
+    import socketserver
+    import threading
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+    class CollectorServer(socketserver.ThreadingMixIn,
+                          socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    server = CollectorServer(path, _request_handler(get))
+    threading.Thread(target=server.serve_forever,
+                     name='pyaltt2:logs:collector',
+                     daemon=True).start()
+    return server
@@ -0,0 +1,93 @@
+"""
+Logs module configuration and helpers, shared by its submodules
+"""
+import logging
+import platform
+import threading
+import time
+
+from functools import lru_cache
+
+from types import SimpleNamespace
+
+logger = logging.getLogger('pyaltt2.logs')
+
+try:
+    import pytz
+    LOCAL_TZ = pytz.timezone(time.tzname[0])
+except:
+    logger.warning(
+        'Unable to determine local time zone, is pytz module installed?')
+    LOCAL_TZ = None
+
+_dropped_records = {
+    'queue': 0,
+    'spill': 0,
+    'sampling': 0,
+    'storm': 0,
+    'collector': 0,
+    'shared': 0,
+    'syslog': 0
+}
+_dropped_lock = threading.Lock()
+
+
+config = SimpleNamespace(
+        name='',
+        host=platform.node(),
+        log_file=None,
+        log_file_buffer=0,
+        log_file_flush_interval=1,
+        log_file_max_bytes=0,
+        log_file_backups=5,
+        log_file_compress=True,
+        log_stdout=2,
+        syslog=None,
+        syslog_queue_size=10000,
+        syslog_batch=100,
+        level=20,
+        tracebacks=False,
+        ignore=None,
+        ignore_mods = [],
+        omit_ignore_for_level=logging.WARNING,
+        stdout_ignore=True,
+        keep_logmem=0,
+        keep_logmem_records=0,
+        keep_logmem_bytes=0,
+        keep_exceptions=0,
+        colorize=True,
+        formatter = logging.Formatter('%(asctime)s ' + platform.node() + \
+            ' %(levelname)s f:%(filename)s mod:%(module)s fn:%(funcName)s ' + \
+            'l:%(lineno)d th:%(threadName)s :: %(message)s'),
+        syslog_formatter = None,
+        log_json=False,
+        syslog_json=False,
+        async_handlers=False,
+        async_queue_size=10000,
+        async_overflow='block',
+        metrics=False,
+        collector=None,
+        logmem_spill_dir=None,
+        logmem_spill_segment=16777216,
+        keep_logmem_spill=0,
+        keep_logmem_spill_bytes=0,
+        logmem_shared=None,
+        logmem_shared_workers=64,
+        logmem_shared_slots=1024,
+        logmem_shared_slot_size=256,
+        storm_limit=0,
+        storm_window=60,
+        storm_keys=10000,
+        sampling=None
+        )
+
+
+@lru_cache(maxsize=256)
+def _compile_pattern(pattern):
+    import re
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def _count_dropped(kind, n=1):
+    with _dropped_lock:
+        _dropped_records[kind] += n
@@ -0,0 +1,84 @@
+"""
+Log formatters
+"""
+import logging
+import datetime
+
+from .common import config
+
+try:
+    import rapidjson as json
+except:
+    import json
+
+
+def _format_json_escaped(handler, record):
+    # same as logging.Formatter.format, but with JSON-escaped message
+    fmt = handler.formatter or logging._defaultFormatter
+    if isinstance(fmt, JSONFormatter):
+        return fmt.format(record)
+    record.message = json.dumps(record.getMessage())[1:-1]
+    if fmt.usesTime():
+        record.asctime = fmt.formatTime(record, fmt.datefmt)
+    s = fmt.formatMessage(record)
+    if record.exc_info and not record.exc_text:
+        record.exc_text = fmt.formatException(record.exc_info)
+    if record.exc_text:
+        if s[-1:] != '\n':
+            s += '\n'
+        s += record.exc_text
+    if record.stack_info:
+        if s[-1:] != '\n':
+            s += '\n'
+        s += fmt.formatStack(record.stack_info)
+    return s
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Log formatter, which serializes the whole record into JSON object
+
+    Fields: t (timestamp), dt (ISO date/time), l (level number), level, msg,
+    mod (module), fn (function), ln (line number), th (thread name), h (host),
+    p (product name), exc (exception traceback, if present), extra fields
+    """
+
+    # standard LogRecord attributes, all others are extra fields
+    _std_fields = frozenset(vars(
+        logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def __init__(self, extra=True):
+        """
+        Args:
+            extra: include extra record fields (default: True)
+        """
+        super().__init__()
+        self.extra = extra
+
+    def format(self, record):
+        d = {
+            't': record.created,
+            'dt': datetime.datetime.fromtimestamp(
+                record.created).astimezone().isoformat(),
+            'l': record.levelno,
+            'level': record.levelname,
+            'msg': record.getMessage(),
+            'mod': record.module,
+            'fn': record.funcName,
+            'ln': record.lineno,
+            'th': record.threadName,
+            'h': config.host,
+            'p': config.name
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            d['exc'] = record.exc_text
+        if record.stack_info:
+            d['stack'] = record.stack_info
+        if self.extra:
+            for k, v in record.__dict__.items():
+                if k not in self._std_fields and not k.startswith('_'):
+                    d[k] = v
+        return json.dumps(d, default=str)
+
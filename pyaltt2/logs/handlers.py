@@ -0,0 +1,409 @@
+"""
+Syslog TCP and buffered file log handlers
+"""
+import logging
+import logging.handlers
+import threading
+import time
+import sys
+import os
+import queue
+import weakref
+
+from functools import lru_cache
+
+from .common import config, _count_dropped
+from .formatters import _format_json_escaped
+
+
+# syslog TCP connection timeout (seconds)
+SYSLOG_TIMEOUT = 5
+
+# min/max delay before re-connecting to syslog server (seconds)
+SYSLOG_RECONNECT_DELAY = 0.5
+SYSLOG_RECONNECT_DELAY_MAX = 30
+
+
+def _syslog_field(value, max_len):
+    # RFC 5424 header fields are printable US-ASCII, without spaces
+    value = ''.join(c for c in str(value) if '!' <= c <= '~')[:max_len]
+    return value or '-'
+
+
+def _syslog_severity(levelno):
+    if levelno >= logging.CRITICAL:
+        return 2
+    elif levelno >= logging.ERROR:
+        return 3
+    elif levelno >= logging.WARNING:
+        return 4
+    elif levelno >= logging.INFO:
+        return 6
+    return 7
+
+
+@lru_cache(maxsize=16)
+def _syslog_timestamp_sec(sec):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(sec))
+
+
+class SyslogTCPHandler(logging.Handler):
+    """
+    Sends log records to a remote syslog server via TCP
+
+    Records are formatted as RFC 5424 messages with octet-counting framing
+    (RFC 6587) and put into a bounded queue. A background thread sends
+    them in batches via a persistent connection, re-connecting with
+    exponential back-off (SYSLOG_RECONNECT_DELAY - SYSLOG_RECONNECT_DELAY_MAX)
+    on errors. If the queue is full, new records are dropped and counted.
+    """
+
+    def __init__(self,
+                 address,
+                 facility=logging.handlers.SysLogHandler.LOG_USER,
+                 app_name=None,
+                 hostname=None,
+                 queue_size=10000,
+                 batch_size=100,
+                 as_json=False):
+        """
+        Args:
+            address: syslog server (host, port)
+            facility: syslog facility (default: user)
+            app_name: RFC 5424 APP-NAME (default: config.name)
+            hostname: RFC 5424 HOSTNAME (default: config.host)
+            queue_size: max records in queue
+            batch_size: max records sent with a single write
+            as_json: format records as JSON
+        """
+        super().__init__()
+        self.address = address
+        self.facility = facility
+        self.as_json = as_json
+        self.batch_size = batch_size
+        self.sock = None
+        self.queue = queue.Queue(queue_size)
+        self._header = ' {} {} '.format(
+            _syslog_field(hostname or config.host, 255),
+            _syslog_field(app_name or config.name, 48))
+        self.failed = False
+        self._stop = threading.Event()
+        self._sender = threading.Thread(target=self._run,
+                                        name='pyaltt2:logs:syslog',
+                                        daemon=True)
+        self._sender.start()
+
+    def format(self, record):
+        if self.as_json:
+            return _format_json_escaped(self, record)
+        return super().format(record)
+
+    def format_message(self, record):
+        """
+        Format record as RFC 5424 message with octet-counting frame
+
+        Returns:
+            bytes
+        """
+        pri = self.facility << 3 | _syslog_severity(record.levelno)
+        t = record.created
+        sec = int(t)
+        msg = '<{}>1 {}.{:06d}Z{}{} - - {}'.format(
+            pri, _syslog_timestamp_sec(sec), int((t - sec) * 1000000),
+            self._header, record.process or '-', self.format(record)).encode()
+        return b'%d %s' % (len(msg), msg)
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.format_message(record))
+        except queue.Full:
+            _count_dropped('syslog')
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def _connect(self):
+        import socket
+        sock = socket.create_connection(self.address, timeout=SYSLOG_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+
+    def close_socket(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _send(self, data):
+        # returns False if the data can not be sent and the handler is closed
+        delay = SYSLOG_RECONNECT_DELAY
+        while True:
+            try:
+                if self.sock is None:
+                    self._connect()
+                    self.failed = False
+                self.sock.sendall(data)
+                return True
+            except OSError:
+                self.close_socket()
+                self.failed = True
+                # wake up flush
+                with self.queue.all_tasks_done:
+                    self.queue.all_tasks_done.notify_all()
+                if self._stop.wait(delay):
+                    return False
+                delay = min(delay * 2, SYSLOG_RECONNECT_DELAY_MAX)
+
+    def _run(self):
+        q = self.queue
+        active = True
+        while True:
+            batch = []
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    msg = q.get_nowait() if batch else q.get()
+                except queue.Empty:
+                    break
+                if msg is None:
+                    stop = True
+                    break
+                batch.append(msg)
+            if batch:
+                if active:
+                    active = self._send(b''.join(batch))
+                if not active:
+                    _count_dropped('syslog', len(batch))
+            for _ in range(len(batch) + stop):
+                q.task_done()
+            if stop:
+                break
+        self.close_socket()
+
+    def flush(self, timeout=SYSLOG_TIMEOUT):
+        """
+        Wait until queued records are sent
+
+        Returns immediately if the server is unavailable
+
+        Args:
+            timeout: max time to wait
+        """
+        q = self.queue
+        with q.all_tasks_done:
+            q.all_tasks_done.wait_for(
+                lambda: not q.unfinished_tasks or self.failed, timeout)
+
+    def close(self):
+        """
+        Send queued records and stop the handler thread
+
+        If the server is unavailable, queued records are dropped
+        """
+        if not self._stop.is_set():
+            self._stop.set()
+            try:
+                self.queue.put(None, timeout=SYSLOG_TIMEOUT)
+            except queue.Full:
+                pass
+            self._sender.join(SYSLOG_TIMEOUT)
+        super().close()
+
+
+def _file_handler_worker(ref, stop, interval):
+    # holds a weak reference only, so dropped handlers are collected and
+    # their files are closed
+    while not stop.wait(interval):
+        handler = ref()
+        if handler is None:
+            return
+        handler.tick()
+        del handler
+
+
+class BufferedFileHandler(logging.handlers.WatchedFileHandler):
+    """
+    Buffered log file handler
+
+    Records are written to the file buffer, which is flushed when full,
+    every flush_interval seconds (by a background thread) and when a record
+    with level >= flush_level is written. If buffer_size is 0, every record is
+    flushed immediately. The same thread checks whether the file has been
+    moved or removed (e.g. by logrotate) and re-opens it, so file stats are
+    not checked for every record.
+
+    If max_bytes is set, the handler rotates the file itself: the current
+    file is renamed and re-opened, shifting backups (log.1.gz, log.2.gz etc.)
+    and gzip compression are performed in a background thread. Rotated files,
+    left unprocessed by a crashed process, are processed when the handler is
+    created.
+    """
+
+    def __init__(self,
+                 filename,
+                 buffer_size=65536,
+                 flush_interval=1,
+                 flush_level=logging.ERROR,
+                 max_bytes=0,
+                 backup_count=5,
+                 compress=True,
+                 as_json=False,
+                 **kwargs):
+        """
+        Args:
+            filename: log file
+            buffer_size: file buffer size (bytes, 0 - flush every record)
+            flush_interval: flush the buffer and check the file every N
+                seconds
+            flush_level: flush the buffer immediately for records with the
+                level >= specified
+            max_bytes: rotate the file when it reaches the size (0 - never)
+            backup_count: number of rotated files to keep (0 - discard)
+            compress: gzip rotated files
+            as_json: format records as JSON
+            **kwargs: passed to WatchedFileHandler as-is
+        """
+        self.as_json = as_json
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.size = 0
+        self._rotator = None
+        super().__init__(filename, **kwargs)
+        self._stop = threading.Event()
+        self._worker = threading.Thread(
+            target=_file_handler_worker,
+            args=(weakref.ref(self), self._stop, flush_interval),
+            name='pyaltt2:logs:file',
+            daemon=True)
+        self._worker.start()
+        import glob
+        # time_ns suffixes have the same length, so names are ordered by time
+        for fname in sorted(glob.glob(glob.escape(self.baseFilename) +
+                                      '.*.rotated')):
+            self._submit_rotated(fname)
+
+    def _open(self):
+        stream = open(self.baseFilename,
+                      self.mode,
+                      buffering=self.buffer_size or -1,
+                      encoding=self.encoding,
+                      errors=self.errors)
+        self.size = os.fstat(stream.fileno()).st_size
+        return stream
+
+    def format(self, record):
+        if self.as_json:
+            return _format_json_escaped(self, record)
+        return super().format(record)
+
+    def emit(self, record):
+        try:
+            msg = self.format(record) + self.terminator
+            if self.stream is None:
+                self.stream = self._open()
+                self._statstream()
+            self.stream.write(msg)
+            # the size is approximate for non-ASCII messages
+            self.size += len(msg)
+            if self.max_bytes and self.size >= self.max_bytes:
+                self.rotate()
+            elif record.levelno >= self.flush_level or not self.buffer_size:
+                self.stream.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def tick(self):
+        """
+        Flush the buffer and re-open the file if it has been moved
+
+        Called by the handler thread every flush_interval seconds
+        """
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.flush()
+                self.reopenIfNeeded()
+        except Exception:
+            if logging.raiseExceptions:
+                import traceback
+                traceback.print_exc(file=sys.stderr)
+        finally:
+            self.release()
+
+    def rotate(self):
+        """
+        Rotate the log file
+
+        The file is renamed and re-opened in the calling thread, backups are
+        shifted and compressed in the background
+        """
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+            fname = f'{self.baseFilename}.{time.time_ns()}.rotated'
+            try:
+                os.rename(self.baseFilename, fname)
+            except FileNotFoundError:
+                fname = None
+            self.stream = self._open()
+            self._statstream()
+            if fname:
+                self._submit_rotated(fname)
+        finally:
+            self.release()
+
+    def _submit_rotated(self, fname):
+        if self._rotator is None:
+            from concurrent.futures import ThreadPoolExecutor
+            # a single worker keeps rotated files in order
+            self._rotator = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='pyaltt2:logs:rotate')
+        self._rotator.submit(self._rotate_backups, fname)
+
+    def _backup_name(self, i):
+        return f'{self.baseFilename}.{i}' + ('.gz' if self.compress else '')
+
+    def _rotate_backups(self, fname):
+        try:
+            if not self.backup_count:
+                os.unlink(fname)
+                return
+            for i in range(self.backup_count - 1, 0, -1):
+                src = self._backup_name(i)
+                if os.path.exists(src):
+                    os.replace(src, self._backup_name(i + 1))
+            dst = self._backup_name(1)
+            if self.compress:
+                import gzip
+                import shutil
+                with open(fname, 'rb') as fh, gzip.open(dst + '.tmp',
+                                                        'wb') as gz:
+                    shutil.copyfileobj(fh, gz)
+                os.replace(dst + '.tmp', dst)
+                os.unlink(fname)
+            else:
+                os.replace(fname, dst)
+        except Exception:
+            if logging.raiseExceptions:
+                import traceback
+                traceback.print_exc(file=sys.stderr)
+
+    def close(self):
+        self._stop.set()
+        if self._rotator is not None:
+            # wait until rotated files are compressed
+            self._rotator.shutdown(wait=True)
+            self._rotator = None
+        super().close()
+
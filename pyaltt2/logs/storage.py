@@ -0,0 +1,799 @@
+"""
+In-memory log records and log record storages
+"""
+import datetime
+import sys
+import os
+import mmap
+import struct
+import time
+import bisect
+
+from functools import lru_cache
+
+from types import SimpleNamespace
+
+from .common import LOCAL_TZ, _count_dropped, _compile_pattern
+
+# approximate memory size of log record w/o message
+LOG_RECORD_OVERHEAD = 200
+
+# compact memory log buffer only if it has at least N expired records
+LOG_COMPACT_MIN = 1000
+
+
+@lru_cache(maxsize=1024)
+def _format_dt_sec(sec):
+    return datetime.datetime.fromtimestamp(sec).replace(
+        tzinfo=LOCAL_TZ).isoformat()
+
+
+def _format_dt(t):
+    # the same as fromtimestamp(t).replace(tzinfo=LOCAL_TZ).isoformat() with
+    # cached formatting of the seconds part
+    sec = int(t)
+    us = round((t - sec) * 1000000)
+    if us >= 1000000:
+        sec += 1
+        us -= 1000000
+    s = _format_dt_sec(sec)
+    return f'{s[:19]}.{us:06d}{s[19:]}' if us else s
+
+
+# dict fields of in-memory log record, others are extra
+_MEM_RECORD_FIELDS = frozenset(('t', 'msg', 'l', 'th', 'mod', 'h', 'p', 'id',
+                                'dt'))
+
+
+def _intern(s):
+    return sys.intern(s) if s.__class__ is str else s
+
+
+class _MemRecord:
+    """
+    Compact in-memory log record
+
+    Repeating strings (thread, module, host, product) are interned, "dt" is
+    formatted only when the record is converted to dict
+    """
+    __slots__ = ('id', 't', 'msg', 'l', 'th', 'mod', 'h', 'p', 'extra')
+
+    def __init__(self, t, msg, l, th=None, mod=None, h=None, p=None,
+                 extra=None):
+        self.id = None
+        self.t = t
+        self.msg = msg
+        self.l = l
+        self.th = _intern(th)
+        self.mod = _intern(mod)
+        self.h = _intern(h)
+        self.p = _intern(p)
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, d):
+        extra = {k: v for k, v in d.items() if k not in _MEM_RECORD_FIELDS}
+        return cls(d['t'], d['msg'], d['l'], d.get('th'), d.get('mod'),
+                   d.get('h'), d.get('p'), extra or None)
+
+    def to_dict(self):
+        d = {'t': self.t, 'msg': self.msg, 'l': self.l, 'mod': self.mod}
+        if self.th is not None:
+            d['th'] = self.th
+        if self.h is not None:
+            d['h'] = self.h
+        if self.p is not None:
+            d['p'] = self.p
+        if self.extra:
+            d.update(self.extra)
+        d['id'] = self.id
+        if LOCAL_TZ:
+            d['dt'] = _format_dt(self.t)
+        return d
+
+
+class _RecordRing:
+    """
+    Time-ordered ring buffer for in-memory log records
+
+    Records are appended to the end and expired from the beginning by moving
+    the start pointer. The list is compacted when more than a half of it is
+    expired, so both operations are amortized O(1). Compaction creates new
+    lists, so snapshots stay valid after the lock is released.
+
+    Each record gets an absolute id ("id" field). The buffer keeps monotonic
+    record times for binary search and per-level lists of record ids.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.base = 0
+        self.clear()
+
+    def clear(self, base=None):
+        # keep ids growing, so clients' cursors stay valid
+        self.base = max(self.base + len(self.records), base or 0)
+        self.records = []
+        self.times = []
+        self.levels = {}
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return len(self.records) - self.start
+
+    def append(self, r):
+        r_id = self.base + len(self.records)
+        r.id = r_id
+        self.records.append(r)
+        t = r.t
+        self.times.append(t if not self.times or t > self.times[-1] else
+                          self.times[-1])
+        try:
+            self.levels[r.l].append(r_id)
+        except KeyError:
+            self.levels[r.l] = [r_id]
+        self.size += len(r.msg) + LOG_RECORD_OVERHEAD
+
+    def popleft(self):
+        r = self.records[self.start]
+        self.start += 1
+        self.size -= len(r.msg) + LOG_RECORD_OVERHEAD
+        if self.start >= LOG_COMPACT_MIN and self.start * 2 > len(
+                self.records):
+            self.records = self.records[self.start:]
+            self.times = self.times[self.start:]
+            self.base += self.start
+            self.start = 0
+            for lv, ids in list(self.levels.items()):
+                ids = ids[bisect.bisect_left(ids, self.base):]
+                if ids:
+                    self.levels[lv] = ids
+                else:
+                    del self.levels[lv]
+        return r
+
+    def expire(self, t):
+        """
+        Remove records older than t
+        """
+        for _ in range(
+                bisect.bisect_left(self.times, t, self.start,
+                                   len(self.records)) - self.start):
+            self.popleft()
+
+    def trim(self, max_records=0, max_bytes=0):
+        """
+        Remove oldest records to fit the limits (0 - no limit)
+        """
+        while len(self) and ((max_records and len(self) > max_records) or
+                             (max_bytes and self.size > max_bytes)):
+            self.popleft()
+
+    def snapshot(self):
+        """
+        Get consistent snapshot of the buffer
+
+        Returns:
+            snapshot object
+        """
+        return SimpleNamespace(
+            records=self.records,
+            times=self.times,
+            base=self.base,
+            start=self.start,
+            end=len(self.records),
+            levels={lv: (ids, len(ids)) for lv, ids in self.levels.items()})
+
+
+
+# spill store record header: payload length, level, time
+_SPILL_HEADER = struct.Struct('<IBd')
+# spill store index entry: monotonic time, offset
+_SPILL_INDEX = struct.Struct('<dQ')
+# index every N-th record of a segment
+SPILL_INDEX_STEP = 64
+
+
+class _SpillSegment:
+    """
+    Memory-mapped segment file of the spill store
+
+    The file is pre-allocated, records are written one after another (payload
+    first, then the header), so the first zero-length header marks the end of
+    data, even after a crash. The index file (.idx) keeps time and offset of
+    every SPILL_INDEX_STEP-th record.
+    """
+
+    def __init__(self, fname, first_id, size=None):
+        self.fname = fname
+        self.first_id = first_id
+        self.next_id = first_id
+        self.end = 0
+        self.t_last = 0
+        self.index_t = []
+        self.index_off = []
+        if size:
+            with open(fname, 'wb') as fh:
+                fh.truncate(size)
+        with open(fname, 'r+b') as fh:
+            self.size = os.fstat(fh.fileno()).st_size
+            self.mm = mmap.mmap(fh.fileno(), 0)
+        if not size:
+            self._load()
+        self._idx = open(fname[:-4] + '.idx', 'ab' if size is None else 'wb',
+                         buffering=0)
+        if size is None and self._idx.tell() != len(
+                self.index_t) * _SPILL_INDEX.size:
+            # the index file is rebuilt from data
+            self._idx.truncate(0)
+            self._idx.write(b''.join(
+                _SPILL_INDEX.pack(t, off)
+                for t, off in zip(self.index_t, self.index_off)))
+
+    def _load(self):
+        try:
+            with open(self.fname[:-4] + '.idx', 'rb') as fh:
+                data = fh.read()
+        except FileNotFoundError:
+            data = b''
+        for t, off in _SPILL_INDEX.iter_unpack(
+                data[:len(data) - len(data) % _SPILL_INDEX.size]):
+            if off >= self.size:
+                break
+            self.index_t.append(t)
+            self.index_off.append(off)
+        k = max(len(self.index_off) - 1, 0)
+        if self.index_off:
+            self.t_last = self.index_t[k]
+            self.end = self.index_off[k]
+        self.next_id = self.first_id + k * SPILL_INDEX_STEP
+        # scan the tail after the last index entry
+        del self.index_t[k:]
+        del self.index_off[k:]
+        while self.end + _SPILL_HEADER.size <= self.size:
+            n, _, t = _SPILL_HEADER.unpack_from(self.mm, self.end)
+            if not n or self.end + _SPILL_HEADER.size + n > self.size:
+                break
+            self._add(t, n)
+
+    def _add(self, t, n):
+        if t > self.t_last:
+            self.t_last = t
+        if not (self.next_id - self.first_id) % SPILL_INDEX_STEP:
+            self.index_t.append(self.t_last)
+            self.index_off.append(self.end)
+        self.end += _SPILL_HEADER.size + n
+        self.next_id += 1
+
+    def append(self, level, t, payload):
+        """
+        Returns:
+            False if the segment is full
+        """
+        n = len(payload)
+        off = self.end
+        pos = off + _SPILL_HEADER.size
+        if pos + n > self.size:
+            return False
+        self.mm[pos:pos + n] = payload
+        _SPILL_HEADER.pack_into(self.mm, off, n, min(level, 255), t)
+        if not (self.next_id - self.first_id) % SPILL_INDEX_STEP:
+            self._idx.write(_SPILL_INDEX.pack(max(t, self.t_last), off))
+        self._add(t, n)
+        return True
+
+    def scan(self, k, end):
+        """
+        Scan records, starting from k-th index entry
+
+        Yields:
+            id, payload offset, payload length, level, time
+        """
+        off = self.index_off[k]
+        rid = self.first_id + k * SPILL_INDEX_STEP
+        mm = self.mm
+        hsize = _SPILL_HEADER.size
+        while off < end:
+            n, level, t = _SPILL_HEADER.unpack_from(mm, off)
+            yield rid, off + hsize, n, level, t
+            off += hsize + n
+            rid += 1
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.flush()
+        self._idx.close()
+
+    def remove(self):
+        # mmap is not closed, it may be still used by readers
+        self._idx.close()
+        for fname in (self.fname, self.fname[:-4] + '.idx'):
+            try:
+                os.unlink(fname)
+            except FileNotFoundError:
+                pass
+
+
+# shared log buffer header: magic, partitions, slots per partition, slot size
+_SHM_HEADER = struct.Struct('<IIII16x')
+_SHM_MAGIC = 0x504c4f47
+# partition header: owner pid, write counter (slots)
+_SHM_PARTITION = struct.Struct('<I4xQ')
+# slot header: sequence (odd while being written), kind, number of slots
+_SHM_SLOT = struct.Struct('<IBB2x')
+# record header (after slot header): payload length, id, time, level
+_SHM_RECORD = struct.Struct('<IQdB3x')
+_SHM_U32 = struct.Struct('<I')
+_SHM_SLOT_RECORD = 1
+_SHM_SLOT_CONT = 2
+
+# shared buffer records, appended during the last N seconds, are not returned
+# for "after" cursors, so records of writers, which are appending them at the
+# moment, are not skipped
+SHARED_CURSOR_DELAY = 0.01
+
+
+class SharedLogBuffer:
+    """
+    Log record ring buffer in shared memory
+
+    The buffer is split into partitions, each writer process claims its own
+    one, so writes need no inter-process locking. Records are written to
+    fixed-size slots, long records continue in the next slots (up to 255
+    slots, longer messages are truncated). Each slot has a sequence lock:
+    readers skip records being overwritten.
+
+    Record ids are based on append time (microseconds) and the partition
+    number, so they are unique and ordered by append time across all writers.
+    Records, appended late (e.g. by async handlers), get ids newer than the
+    already returned ones, so "after" cursors work across all writers (see
+    SHARED_CURSOR_DELAY).
+
+    The shared memory block outlives the processes, call "unlink" to remove
+    it.
+    """
+
+    def __init__(self, name, partitions=64, slots=1024, slot_size=256):
+        """
+        Args:
+            name: shared memory block name
+            partitions: max writer processes (for a new block)
+            slots: slots per partition (for a new block)
+            slot_size: slot size in bytes (for a new block)
+        """
+        import msgpack
+        from multiprocessing import shared_memory, resource_tracker
+        self._unpackb = msgpack.unpackb
+        self.name = name
+        size = _SHM_HEADER.size + partitions * (_SHM_PARTITION.size +
+                                                slots * slot_size)
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+            _SHM_HEADER.pack_into(self.shm.buf, 0, 0, partitions, slots,
+                                  slot_size)
+            _SHM_U32.pack_into(self.shm.buf, 0, _SHM_MAGIC)
+        except FileExistsError:
+            self.shm = shared_memory.SharedMemory(name)
+        # the block must not be removed when a worker exits
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+        buf = self.shm.buf
+        for _ in range(100):
+            magic, self.partitions, self.slots, self.slot_size = \
+                _SHM_HEADER.unpack_from(buf, 0)
+            if magic == _SHM_MAGIC:
+                break
+            time.sleep(0.01)
+        else:
+            raise RuntimeError(f'Shared log buffer {name} is not initialized')
+        self.buf = buf
+        self.partition = None
+        self._pid = None
+        self._last_id = 0
+        self._packer = msgpack.Packer(default=str)
+        # payload capacity of the first and continuation slots
+        self._first_len = self.slot_size - _SHM_SLOT.size - _SHM_RECORD.size
+        self._cont_len = self.slot_size - _SHM_SLOT.size
+        self._max_len = self._first_len + self._cont_len * (
+            min(255, self.slots // 2) - 1)
+        self._slots_offset = _SHM_HEADER.size + self.partitions * \
+            _SHM_PARTITION.size
+
+    def _partition_offset(self, i):
+        return _SHM_HEADER.size + i * _SHM_PARTITION.size
+
+    def _slot_offset(self, i, slot):
+        return self._slots_offset + (i * self.slots + slot) * self.slot_size
+
+    def claim(self):
+        """
+        Claim a partition for the current process
+
+        Partitions of dead processes are re-used, their records are kept
+
+        Raises:
+            RuntimeError: if there are no free partitions
+        """
+        import fcntl
+        import tempfile
+        pid = os.getpid()
+        with open(os.path.join(tempfile.gettempdir(),
+                               f'pyaltt2-logs-{self.name}.lock'),
+                  'w') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            for i in range(self.partitions):
+                owner, _ = _SHM_PARTITION.unpack_from(
+                    self.buf, self._partition_offset(i))
+                if owner and owner != pid:
+                    try:
+                        os.kill(owner, 0)
+                        continue
+                    except PermissionError:
+                        continue
+                    except ProcessLookupError:
+                        pass
+                _SHM_U32.pack_into(self.buf, self._partition_offset(i), pid)
+                self.partition = i
+                self._pid = pid
+                self._last_id = 0
+                return
+        raise RuntimeError(f'No free partitions in shared log buffer '
+                           f'{self.name}')
+
+    def append(self, r):
+        """
+        Append in-memory log record, the caller must serialize calls
+
+        Args:
+            r: in-memory log record (id is assigned)
+        """
+        if self._pid != os.getpid():
+            # not claimed or forked
+            self.claim()
+        i = self.partition
+        rid = int(time.time() * 1000000)
+        if rid <= self._last_id:
+            rid = self._last_id + 1
+        self._last_id = rid
+        r.id = rid * self.partitions + i
+        data = [r.msg, r.mod, r.th, r.h, r.p]
+        if r.extra:
+            data.append(r.extra)
+        payload = self._packer.pack(data)
+        while len(payload) > self._max_len:
+            if len(data) > 5:
+                del data[5:]
+            elif data[0]:
+                data[0] = data[0][:max(
+                    len(data[0]) - (len(payload) - self._max_len) - 1, 0)]
+            else:
+                _count_dropped('shared')
+                return
+            payload = self._packer.pack(data)
+        n = len(payload)
+        first = self._first_len
+        buf = self.buf
+        poff = self._partition_offset(i)
+        _, w = _SHM_PARTITION.unpack_from(buf, poff)
+        if n <= first:
+            # fast path for a single-slot record
+            off = self._slot_offset(i, w % self.slots)
+            seq = _SHM_U32.unpack_from(buf, off)[0] | 1
+            _SHM_U32.pack_into(buf, off, seq)
+            _SHM_RECORD.pack_into(buf, off + _SHM_SLOT.size, n, r.id, r.t,
+                                  min(r.l, 255))
+            start = off + _SHM_SLOT.size + _SHM_RECORD.size
+            buf[start:start + n] = payload
+            _SHM_SLOT.pack_into(buf, off, (seq + 1) & 0xffffffff,
+                                _SHM_SLOT_RECORD, 1)
+            _SHM_PARTITION.pack_into(buf, poff, self._pid, w + 1)
+            return
+        cont = self._cont_len
+        nslots = 2 + (n - first - 1) // cont
+        offsets = [
+            self._slot_offset(i, (w + k) % self.slots) for k in range(nslots)
+        ]
+        seqs = [_SHM_U32.unpack_from(buf, off)[0] | 1 for off in offsets]
+        for off, seq in zip(offsets, seqs):
+            _SHM_U32.pack_into(buf, off, seq)
+        _SHM_RECORD.pack_into(buf, offsets[0] + _SHM_SLOT.size, n, r.id, r.t,
+                              min(r.l, 255))
+        start = offsets[0] + _SHM_SLOT.size + _SHM_RECORD.size
+        buf[start:start + first] = payload[:first]
+        pos = first
+        for off in offsets[1:]:
+            chunk = payload[pos:pos + cont]
+            start = off + _SHM_SLOT.size
+            buf[start:start + len(chunk)] = chunk
+            pos += cont
+        for k, (off, seq) in enumerate(zip(offsets, seqs)):
+            _SHM_SLOT.pack_into(buf, off, (seq + 1) & 0xffffffff,
+                                _SHM_SLOT_CONT if k else _SHM_SLOT_RECORD,
+                                nslots)
+        _SHM_PARTITION.pack_into(buf, poff, self._pid, w + nslots)
+
+    def _read(self, i, slot):
+        """
+        Read record header from the slot
+
+        Returns:
+            (seq, slots, payload length, id, time, level) or None if the slot
+            is being written or is not a record start
+        """
+        buf = self.buf
+        off = self._slot_offset(i, slot % self.slots)
+        seq, kind, nslots = _SHM_SLOT.unpack_from(buf, off)
+        if seq & 1 or kind != _SHM_SLOT_RECORD:
+            return None
+        n, rid, t, level = _SHM_RECORD.unpack_from(buf, off + _SHM_SLOT.size)
+        return seq, nslots, n, rid, t, level
+
+    def _payload(self, i, slot, seq, nslots, n):
+        buf = self.buf
+        first = self._first_len
+        cont = self._cont_len
+        offsets = [
+            self._slot_offset(i, (slot + k) % self.slots)
+            for k in range(nslots)
+        ]
+        seqs = [_SHM_U32.unpack_from(buf, off)[0] for off in offsets]
+        if seqs[0] != seq or any(s & 1 for s in seqs):
+            return None
+        off = offsets[0] + _SHM_SLOT.size + _SHM_RECORD.size
+        chunks = [bytes(buf[off:off + min(n, first)])]
+        left = n - first
+        for off in offsets[1:]:
+            start = off + _SHM_SLOT.size
+            chunks.append(bytes(buf[start:start + min(left, cont)]))
+            left -= cont
+        if [_SHM_U32.unpack_from(buf, off)[0] for off in offsets] != seqs:
+            return None
+        return b''.join(chunks)
+
+    def get(self, level=0, t=0, n=100, pattern=None, after=None):
+        """
+        Get records from all partitions
+
+        Args are the same as for logs.get
+
+        Returns:
+            list of in-memory log records, the oldest first
+        """
+        now = time.time()
+        t_min = now - t if t else None
+        # ids are ordered by append time in the partitions
+        id_min = int(t_min * 1000000) * self.partitions if t else None
+        id_max = int(
+            (now - SHARED_CURSOR_DELAY) *
+            1000000) * self.partitions if after is not None else None
+        rgx = _compile_pattern(pattern).search if pattern else None
+        result = []
+        for i in range(self.partitions):
+            _, w = _SHM_PARTITION.unpack_from(self.buf,
+                                              self._partition_offset(i))
+            if not w:
+                continue
+            found = []
+            slot = w - 1
+            lo = max(w - self.slots, 0)
+            while slot >= lo:
+                rec = self._read(i, slot)
+                if rec is None:
+                    slot -= 1
+                    continue
+                seq, nslots, size, rid, rt, rl = rec
+                if slot + nslots > w or slot < lo:
+                    slot -= 1
+                    continue
+                if (after is not None and
+                        rid <= after) or (id_min is not None and rid < id_min):
+                    break
+                if rl >= level and (t_min is None or rt >= t_min) and (
+                        id_max is None or rid < id_max):
+                    payload = self._payload(i, slot, seq, nslots, size)
+                    if payload is not None:
+                        data = self._unpackb(payload)
+                        if rgx is None or rgx(data[0]):
+                            r = _MemRecord(rt, data[0], rl, data[2], data[1],
+                                           data[3], data[4],
+                                           data[5] if len(data) > 5 else None)
+                            r.id = rid
+                            found.append(r)
+                            if after is None and len(found) >= n:
+                                break
+                slot -= 1
+            result.extend(found)
+        result.sort(key=lambda r: r.id)
+        return result[:n] if after is not None else result[-n:]
+
+    def close(self):
+        """
+        Detach from the shared memory block
+        """
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Remove the shared memory block
+        """
+        from multiprocessing import resource_tracker
+        # unlink unregisters the block in resource tracker
+        resource_tracker.register(self.shm._name, 'shared_memory')
+        self.shm.unlink()
+
+
+class LogSpillStore:
+    """
+    Persistent on-disk store for in-memory log records
+
+    Records are appended to memory-mapped segment files (msgpack-encoded
+    payload with level and time in a binary header), segments have sparse
+    time indexes. The oldest segments are removed by age or total size.
+
+    Appends must be serialized by the caller (logs module calls the store
+    under the records lock), reads work with snapshots and do not block
+    writers.
+    """
+
+    def __init__(self, path, segment_size=16777216, max_age=0, max_bytes=0):
+        """
+        Args:
+            path: store directory (created if missing)
+            segment_size: segment file size (default: 16 MiB)
+            max_age: max record age (seconds, 0 - no limit)
+            max_bytes: max total size of segment files (0 - no limit)
+        """
+        import msgpack
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+        self.path = path
+        self.segment_size = segment_size
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self.segments = [
+            _SpillSegment(os.path.join(path, fname), int(fname[:-4]))
+            for fname in sorted(os.listdir(path))
+            if fname.endswith('.seg') and fname[:-4].isdigit()
+        ]
+        self.next_id = self.segments[-1].next_id if self.segments else 0
+        self.cleanup()
+
+    def append(self, r):
+        """
+        Append log record
+
+        Args:
+            r: in-memory log record, with id assigned
+        """
+        rid = r.id
+        d = {'msg': r.msg, 'mod': r.mod}
+        for k in ('th', 'h', 'p'):
+            v = getattr(r, k)
+            if v is not None:
+                d[k] = v
+        if r.extra:
+            d.update(r.extra)
+        payload = self._packb(d)
+        seg = self.segments[-1] if self.segments else None
+        if seg is None or seg.next_id != rid or not seg.append(
+                r.l, r.t, payload):
+            if seg:
+                seg.flush()
+            seg = _SpillSegment(
+                os.path.join(self.path, f'{rid:020d}.seg'), rid,
+                max(self.segment_size, len(payload) + _SPILL_HEADER.size))
+            seg.append(r.l, r.t, payload)
+            self.segments = self.segments + [seg]
+            self.cleanup()
+        self.next_id = rid + 1
+
+    def cleanup(self, t=None):
+        """
+        Remove obsolete segments
+
+        Args:
+            t: current time (default: now)
+        """
+        if t is None:
+            t = time.time()
+        segs = self.segments
+        total = sum(s.size for s in segs)
+        drop = 0
+        # the active segment is never removed
+        while drop < len(segs) - 1 and (
+            (self.max_age and segs[drop].t_last < t - self.max_age) or
+            (self.max_bytes and total > self.max_bytes)):
+            total -= segs[drop].size
+            drop += 1
+        if drop:
+            self.segments = segs[drop:]
+            for s in segs[:drop]:
+                s.remove()
+
+    def snapshot(self):
+        """
+        Get store snapshot, must be called under the same lock as append
+        """
+        return [(s, s.end, s.next_id) for s in self.segments]
+
+    @staticmethod
+    def first_id(snap):
+        """
+        Get the first record id in snapshot
+        """
+        return snap[0][0].first_id if snap else 0
+
+    @staticmethod
+    def id_for_time(snap, t):
+        """
+        Get id of the first record in snapshot with time >= t
+        """
+        for seg, end, next_id in snap:
+            if next_id == seg.first_id or seg.t_last < t:
+                continue
+            nk = (next_id - 1 - seg.first_id) // SPILL_INDEX_STEP + 1
+            k = max(bisect.bisect_left(seg.index_t, t, 0, nk) - 1, 0)
+            for rid, _, _, _, rt in seg.scan(k, end):
+                if rt >= t:
+                    return rid
+        return snap[-1][2] if snap else 0
+
+    def records(self, snap, lo, hi, reverse=False, level=0):
+        """
+        Get records from snapshot
+
+        Args:
+            snap: store snapshot
+            lo: min record id
+            hi: max record id (exclusive)
+            reverse: the newest records first
+            level: minimal log level
+
+        Yields:
+            in-memory log records
+        """
+        unpackb = self._unpackb
+        for seg, end, next_id in (reversed(snap) if reverse else snap):
+            first = seg.first_id
+            a = max(lo, first)
+            b = min(hi, next_id)
+            if a >= b:
+                continue
+            ka = (a - first) // SPILL_INDEX_STEP
+            kb = (b - 1 - first) // SPILL_INDEX_STEP
+            mm = seg.mm
+            for k in (range(kb, ka - 1, -1) if reverse else range(ka, kb + 1)):
+                block = []
+                block_end = min(b, first + (k + 1) * SPILL_INDEX_STEP)
+                for item in seg.scan(k, end):
+                    if item[0] >= block_end:
+                        break
+                    if item[0] >= a and item[3] >= level:
+                        block.append(item)
+                for rid, off, n, l, t in (reversed(block)
+                                          if reverse else block):
+                    d = unpackb(mm[off:off + n])
+                    d['t'] = t
+                    d['l'] = l
+                    r = _MemRecord.from_dict(d)
+                    r.id = rid
+                    yield r
+
+    def flush(self):
+        """
+        Flush the active segment to disk
+        """
+        if self.segments:
+            self.segments[-1].flush()
+
+    def close(self):
+        """
+        Flush and close the store
+        """
+        for s in self.segments:
+            s.close()
+
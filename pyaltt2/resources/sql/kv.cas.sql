@@ -0,0 +1,4 @@
+UPDATE {}
+SET content=:content
+WHERE id=:id
+  AND content=:expected
@@ -0,0 +1,8 @@
+DELETE
+FROM {0}_chunks
+WHERE NOT EXISTS
+    (SELECT 1
+     FROM {0}
+     WHERE {0}.id={0}_chunks.id
+       AND (d_expires IS NULL
+            OR d_expires>=:d))
@@ -0,0 +1,3 @@
+DELETE
+FROM {}_chunks
+WHERE id=:id
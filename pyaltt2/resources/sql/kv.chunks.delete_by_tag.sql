@@ -0,0 +1,6 @@
+DELETE
+FROM {0}_chunks
+WHERE id IN
+    (SELECT id
+     FROM {0}_tags
+     WHERE tag=:tag)
@@ -0,0 +1,4 @@
+SELECT content
+FROM {}_chunks
+WHERE id=:id
+  AND chunk=:chunk
@@ -0,0 +1,4 @@
+INSERT INTO {}_chunks (id,
+                       chunk,
+                       content)
+VALUES (:id, :chunk, :content)
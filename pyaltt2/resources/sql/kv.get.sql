@@ -1,3 +1,4 @@
-SELECT content
+SELECT content,
+       n
 FROM {}
 WHERE id=:id
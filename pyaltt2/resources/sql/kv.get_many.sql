@@ -0,0 +1,5 @@
+SELECT id,
+       content,
+       n
+FROM {0}
+WHERE id IN ({1})
@@ -0,0 +1,6 @@
+SELECT id
+FROM {0}
+WHERE id IN
+    (SELECT id
+     FROM {0}_tags
+     WHERE tag=:tag)
@@ -0,0 +1,7 @@
+INSERT INTO {0} (id,
+                 n,
+                 d_expires)
+VALUES (:id, :delta, :d_expires) ON DUPLICATE KEY
+UPDATE n=IF(d_expires < :d, VALUES(n), IF(content IS NULL, COALESCE(n, 0) + VALUES(n), n)),
+       content=IF(d_expires < :d, NULL, content),
+       d_expires=IF(d_expires < :d, VALUES(d_expires), d_expires)
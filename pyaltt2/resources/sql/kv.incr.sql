@@ -0,0 +1,16 @@
+INSERT INTO {0} (id,
+                 n,
+                 d_expires)
+VALUES (:id, :delta, :d_expires) ON CONFLICT (id) DO
+UPDATE
+SET content=NULL,
+    n=CASE
+          WHEN {0}.d_expires < :d THEN :delta
+          ELSE COALESCE({0}.n, 0) + :delta
+      END,
+    d_expires=CASE
+                  WHEN {0}.d_expires < :d THEN :d_expires
+                  ELSE {0}.d_expires
+              END
+WHERE {0}.content IS NULL
+    OR {0}.d_expires < :d{1}
@@ -1,3 +0,0 @@
-INSERT INTO {} (id,
-                content)
-VALUES (:id, :content)
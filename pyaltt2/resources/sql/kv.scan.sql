@@ -0,0 +1,6 @@
+SELECT id{1}
+FROM {0}
+WHERE (d_expires IS NULL
+       OR d_expires>=:d){2}
+ORDER BY id
+LIMIT :limit
@@ -0,0 +1,6 @@
+DELETE
+FROM {0}_tags
+WHERE NOT EXISTS
+    (SELECT 1
+     FROM {0}
+     WHERE {0}.id={0}_tags.id)
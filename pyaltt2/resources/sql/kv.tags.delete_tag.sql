@@ -0,0 +1,3 @@
+DELETE
+FROM {}_tags
+WHERE tag=:tag
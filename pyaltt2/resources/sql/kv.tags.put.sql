@@ -0,0 +1,3 @@
+INSERT INTO {}_tags (id,
+                     tag)
+VALUES (:id, :tag)
@@ -0,0 +1,7 @@
+INSERT INTO {} (id,
+                content,
+                d_expires)
+VALUES (:id, :content, :d_expires) ON DUPLICATE KEY
+UPDATE content=VALUES(content),
+       n=NULL,
+       d_expires=VALUES(d_expires)
@@ -0,0 +1,8 @@
+INSERT INTO {} (id,
+                content,
+                d_expires)
+VALUES (:id, :content, :d_expires) ON CONFLICT (id) DO
+UPDATE
+SET content=excluded.content,
+    n=NULL,
+    d_expires=excluded.d_expires
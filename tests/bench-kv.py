@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+KVStorage vs SQLiteKVStorage benchmark
+"""
+
+from pathlib import Path
+import sys
+import os
+import time
+
+sys.path.insert(0, Path().absolute().parent.as_posix())
+
+import pyaltt2.db
+
+ITERS = 5000
+
+DB_FILE = '/tmp/pyaltt2-bench-kv.db'
+
+
+def cleanup():
+    for f in ('', '-wal', '-shm'):
+        try:
+            os.unlink(DB_FILE + f)
+        except FileNotFoundError:
+            pass
+
+
+def bench(title, kv):
+    t = time.perf_counter()
+    for i in range(ITERS):
+        kv.put(f'key{i}', {'value': i})
+    t_put = time.perf_counter() - t
+    t = time.perf_counter()
+    for i in range(ITERS):
+        kv.get(f'key{i}')
+    t_get = time.perf_counter() - t
+    print(f'{title:>16}: put {ITERS / t_put:>10.0f} op/s, '
+          f'get {ITERS / t_get:>10.0f} op/s')
+
+
+cleanup()
+try:
+    db = pyaltt2.db.Database(DB_FILE)
+    db.execute('pragma journal_mode=WAL')
+    bench('KVStorage', pyaltt2.db.KVStorage(db, table_name='kv1'))
+    bench('SQLiteKVStorage', pyaltt2.db.SQLiteKVStorage(DB_FILE,
+                                                        table_name='kv2'))
+finally:
+    cleanup()
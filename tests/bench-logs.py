@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+pyaltt2.logs formatters and filter pipeline benchmark
+"""
+
+from pathlib import Path
+import sys
+import os
+import time
+import logging
+
+sys.path.insert(0, Path().absolute().parent.as_posix())
+
+import pyaltt2.logs
+
+ITERS = 50000
+
+
+def bench(title, handler):
+    logger = logging.getLogger('pyaltt2.bench')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers = [handler]
+    t = time.perf_counter()
+    for i in range(ITERS):
+        logger.info('test "message" %s', i, extra={'request_id': i})
+    t = time.perf_counter() - t
+    handler.close()
+    print(f'{title:>24}: {t / ITERS * 1000000:>8.2f} us/record')
+
+
+def file_handler(formatter, as_json=False):
+    h = pyaltt2.logs.JWatchedFileHandler(os.devnull, as_json=as_json)
+    h.setFormatter(formatter)
+    return h
+
+
+bench('text', file_handler(pyaltt2.logs.config.formatter))
+bench('text, escaped JSON msg',
+      file_handler(pyaltt2.logs.config.formatter, as_json=True))
+bench('JSONFormatter', file_handler(pyaltt2.logs.JSONFormatter()))
+bench('JSONFormatter, no extra',
+      file_handler(pyaltt2.logs.JSONFormatter(extra=False)))
+
+
+def bench_root(title, **kwargs):
+    pyaltt2.logs.init(log_stdout=1,
+                      keep_logmem=60,
+                      keep_logmem_records=10000,
+                      colorize=False,
+                      ignore='.',
+                      ignore_mods=[f'mod{i}' for i in range(50)],
+                      **kwargs)
+    devnull = open(os.devnull, 'w')
+    for h in logging.getLogger().handlers:
+        if isinstance(h, pyaltt2.logs.StdoutHandler):
+            h.setStream(devnull)
+    t = time.perf_counter()
+    for i in range(ITERS):
+        logging.info('test "message" %s', i)
+    t = time.perf_counter() - t
+    pyaltt2.logs.init(log_stdout=0, keep_logmem=0, sampling=None)
+    devnull.close()
+    print(f'{title:>24}: {t / ITERS * 1000000:>8.2f} us/record')
+
+
+bench_root('stdout + memory')
+bench_root('sampled out',
+           sampling=[{
+               'mod': 'bench-logs',
+               'rate': 0
+           }])
@@ -49,7 +49,8 @@ import signal
 pyaltt2.logs.set_debug(False)
 os.system('mv test.log test.log.1')
 test_logging()
-assert len(pyaltt2.logs.serialize()['exceptions']) == 10
+assert len(pyaltt2.logs.serialize()['exceptions']) == 1
+assert pyaltt2.logs.serialize()['exceptions'][0]['count'] == 11
 print('Completed')
 from pprint import pprint
 pyaltt2.logs.set_debug(True)
@@ -6,6 +6,7 @@ import os
 import pytest
 import logging
 import time
+import threading
 
 sys.path.insert(0, Path().absolute().parent.as_posix())
 
@@ -18,6 +19,7 @@ import pyaltt2.json
 import pyaltt2.config
 import pyaltt2.res
 import pyaltt2.db
+import pyaltt2.logs
 
 from types import SimpleNamespace
 
@@ -115,6 +117,1163 @@ def test_db():
         os.unlink('/tmp/pyaltt2-test.db')
 
 
+def test_kv_codecs():
+    try:
+        db = pyaltt2.db.Database('/tmp/pyaltt2-test-kv.db')
+        kv = pyaltt2.db.KVStorage(db=db)
+        from msgpack import dumps
+        kv.db.query('kv.put.expires',
+                    qargs=[kv.table_name],
+                    id='legacy',
+                    content=dumps({'a': 1}),
+                    d_expires=None)
+        assert kv.get('legacy') == {'a': 1}
+        big = {'data': 'x' * 100000}
+        kv.put('big', big)
+        assert len(kv.db.query('kv.get', qargs=[kv.table_name],
+                               id='big').fetchone().content) < 1000
+        assert kv.get('big') == big
+        for codec, value in (('json', {'a': [1, 2]}), ('pickle', {1, 2}),
+                             ('raw', b'\x00\x01')):
+            kv2 = pyaltt2.db.KVStorage(db=db, codec=codec, compression=None)
+            kv2.put(codec, value)
+            assert kv.get(codec) == value
+        with pytest.raises(ValueError):
+            pyaltt2.db.KVStorage(db=db, codec='xml')
+        with pytest.raises(TypeError):
+            pyaltt2.db.kv_encode(5, codec='raw')
+        assert pyaltt2.db.kv_decode(
+            pyaltt2.db.kv_encode(bytearray(b'\x01'), codec='raw')) == b'\x01'
+    finally:
+        os.unlink('/tmp/pyaltt2-test-kv.db')
+
+
+def test_kv_sharded():
+    try:
+        db = pyaltt2.db.Database('/tmp/pyaltt2-test-kv.db')
+        kv = pyaltt2.db.ShardedKVStorage(db=db, tables=4)
+        assert len(kv.shards) == 4
+        for i in range(40):
+            kv.put(f'key{i}', i)
+        for i in range(40):
+            assert kv.get(f'key{i}') == i
+        for s in kv.shards:
+            assert s.db.lookup(f'SELECT COUNT(*) AS c FROM {s.table_name}')['c']
+        key = kv.put(value=123, expires=0)
+        assert kv.get(key) == 123
+        kv.cleanup()
+        with pytest.raises(LookupError):
+            kv.get(key)
+        kv.delete('key1')
+        with pytest.raises(LookupError):
+            kv.delete('key1')
+        kv2 = pyaltt2.db.ShardedKVStorage(db=db, tables=5)
+        moved = sum(
+            kv.get_shard(f'key{i}').table_name != kv2.get_shard(
+                f'key{i}').table_name for i in range(40))
+        assert moved < 20
+        # unsharded storage -> 2 tables: the old table stays the first shard
+        kv = pyaltt2.db.KVStorage(db=db, table_name='kv1')
+        for i in range(100):
+            kv.put(f'key{i}', i)
+        kv2 = pyaltt2.db.ShardedKVStorage(db=db, tables=2, table_name='kv1')
+        assert kv2.shards[0].table_name == 'kv1'
+        kept = [
+            i for i in range(100)
+            if kv2.get_shard(f'key{i}') is kv2.shards[0]
+        ]
+        assert 25 < len(kept) < 75
+        for i in kept:
+            assert kv2.get(f'key{i}') == i
+    finally:
+        os.unlink('/tmp/pyaltt2-test-kv.db')
+
+
+def test_kv_sqlite():
+    try:
+        kv = pyaltt2.db.SQLiteKVStorage('/tmp/pyaltt2-test-kv.db')
+        kv.put('test', 123)
+        assert kv.get('test') == 123
+        assert kv.get('test', delete=True) == 123
+        with pytest.raises(LookupError):
+            kv.get('test')
+        with pytest.raises(LookupError):
+            kv.delete('test')
+        key = kv.put(value={'a': 2, 'b': 3}, expires=0)
+        kv.put(key, {'a': 5, 'b': 8}, expires=0)
+        assert kv.get(key)['a'] == 5
+        kv.put('persistent', 'x' * 10000)
+        # the same table is readable with SQLAlchemy-based storage
+        kv2 = pyaltt2.db.KVStorage(
+            db=pyaltt2.db.Database('/tmp/pyaltt2-test-kv.db'))
+        assert kv2.get(key)['b'] == 8
+        kv.cleanup()
+        with pytest.raises(LookupError):
+            kv.get(key)
+        assert kv.get('persistent') == 'x' * 10000
+    finally:
+        for f in ('', '-wal', '-shm'):
+            try:
+                os.unlink(f'/tmp/pyaltt2-test-kv.db{f}')
+            except FileNotFoundError:
+                pass
+
+
+def test_kv_incr_cas():
+    try:
+        db = pyaltt2.db.Database('/tmp/pyaltt2-test-kv.db')
+        for kv in (pyaltt2.db.KVStorage(db=db, table_name='kv1'),
+                   pyaltt2.db.SQLiteKVStorage('/tmp/pyaltt2-test-kv.db',
+                                              table_name='kv2')):
+            for use_returning in (True, False):
+                kv.use_returning = use_returning
+                key = f'counter{use_returning}'
+                assert kv.incr(key) == 1
+                assert kv.incr(key, 5) == 6
+                assert kv.incr(key, -2) == 4
+                assert kv.get(key) == 4
+            assert kv.incr('limiter', expires=0) == 1
+            assert kv.incr('limiter', expires=0) == 1
+            for use_returning in (True, False):
+                kv.use_returning = use_returning
+                kv.put('test', 100)
+                with pytest.raises(ValueError):
+                    kv.incr('test')
+                assert kv.get('test') == 100
+            kv.put('expired', 100, expires=-1)
+            assert kv.incr('expired') == 1
+            kv.put('test', {'a': 1})
+            with pytest.raises(pyaltt2.db.KeyExistsError):
+                kv.put('test', 1, override=False)
+            assert kv.cas('test', {'a': 1}, {'a': 2})
+            assert not kv.cas('test', {'a': 1}, {'a': 3})
+            assert not kv.cas('test2', {'a': 1}, {'a': 3})
+            assert kv.get('test') == {'a': 2}
+    finally:
+        for f in ('', '-wal', '-shm'):
+            try:
+                os.unlink(f'/tmp/pyaltt2-test-kv.db{f}')
+            except FileNotFoundError:
+                pass
+
+
+def test_kv_scan():
+    try:
+        db = pyaltt2.db.Database('/tmp/pyaltt2-test-kv.db')
+        kv = pyaltt2.db.KVStorage(db=db)
+        for i in range(25):
+            kv.put(f'a/{i:02}', i)
+            kv.put(f'b/{i:02}', i)
+        kv.put('a/expired', 0, expires=-1)
+        kv.incr('a/counter')
+        assert kv.scan(prefix='a/', page_size=3) == ['a/00', 'a/01', 'a/02']
+        assert kv.scan(prefix='a/', page_size=2,
+                       after='a/24') == ['a/counter']
+        assert len(kv.scan(page_size=1000)) == 51
+        items = list(kv.iter_items(prefix='b/', page_size=7))
+        assert items == [(f'b/{i:02}', i) for i in range(25)]
+        assert dict(kv.iter_items(prefix='a/c'))['a/counter'] == 1
+        skv = pyaltt2.db.ShardedKVStorage(db=db, tables=3)
+        for i in range(25):
+            skv.put(f'c/{i:02}', i)
+        assert skv.scan(prefix='c/', page_size=5,
+                        after='c/03') == [f'c/{i:02}' for i in range(4, 9)]
+        assert list(skv.iter_items(prefix='c/',
+                                   page_size=4)) == [(f'c/{i:02}', i)
+                                                     for i in range(25)]
+    finally:
+        os.unlink('/tmp/pyaltt2-test-kv.db')
+
+
+def test_kv_many():
+    try:
+        db = pyaltt2.db.Database('/tmp/pyaltt2-test-kv.db')
+        for kv in (pyaltt2.db.KVStorage(db=db, table_name='kv1'),
+                   pyaltt2.db.ShardedKVStorage(db=db,
+                                               tables=3,
+                                               table_name='kv2'),
+                   pyaltt2.db.SQLiteKVStorage('/tmp/pyaltt2-test-kv.db',
+                                              table_name='kv3')):
+            data = {f'key{i}': i for i in range(1200)}
+            kv.put_many(data)
+            kv.put_many({'key1': 'x'})
+            result = kv.get_many(list(data) + ['missing'])
+            assert len(result) == 1200
+            assert result['key0'] == 0
+            assert result['key1'] == 'x'
+    finally:
+        for f in ('', '-wal', '-shm'):
+            try:
+                os.unlink(f'/tmp/pyaltt2-test-kv.db{f}')
+            except FileNotFoundError:
+                pass
+
+
+def test_kv_async():
+    import asyncio
+    try:
+        db = pyaltt2.db.Database('/tmp/pyaltt2-test-kv.db')
+        kv = pyaltt2.db.KVStorage(db=db)
+        akv = pyaltt2.db.AsyncKVStorage(kv)
+        calls = []
+        get = kv.get
+
+        def counting_get(*args, **kwargs):
+            calls.append(args)
+            result = get(*args, **kwargs)
+            time.sleep(0.1)
+            return result
+
+        kv.get = counting_get
+
+        async def run():
+            await akv.put('test', 123)
+            assert await asyncio.gather(*[akv.get('test')
+                                          for _ in range(10)]) == [123] * 10
+            assert len(calls) == 1
+            await akv.put_many({'a': 1, 'b': 2})
+            assert await akv.get_many(['a', 'b']) == {'a': 1, 'b': 2}
+            await akv.delete('a')
+            with pytest.raises(LookupError):
+                await akv.get('a')
+            # gets after a write are not merged with the older ones
+            await akv.put('k', 1)
+            old = asyncio.ensure_future(akv.get('k'))
+            await asyncio.sleep(0.05)
+            await akv.put('k', 2)
+            assert await akv.get('k') == 2
+            assert await old == 1
+            await akv.put_many({'k': 3})
+            assert await asyncio.gather(akv.get('k'), old) == [3, 1]
+            await akv.cleanup()
+
+        asyncio.run(run())
+        akv.close()
+    finally:
+        os.unlink('/tmp/pyaltt2-test-kv.db')
+
+
+def test_kv_write_behind():
+    try:
+        db = pyaltt2.db.Database('/tmp/pyaltt2-test-kv.db')
+        kv = pyaltt2.db.KVStorage(db=db,
+                                  write_behind=True,
+                                  flush_interval=60,
+                                  flush_size=50)
+        kv2 = pyaltt2.db.KVStorage(db=db)
+        for i in range(10):
+            kv.put('metric', i)
+        kv.put('other', 1)
+        assert kv.get('metric') == 9
+        assert kv.get_many(['metric', 'other']) == {'metric': 9, 'other': 1}
+        with pytest.raises(LookupError):
+            kv2.get('metric')
+        with pytest.raises(pyaltt2.db.KeyExistsError):
+            kv.put('metric', 1, override=False)
+        kv.delete('other')
+        with pytest.raises(LookupError):
+            kv.get('other')
+        kv.flush()
+        assert kv2.get('metric') == 9
+        for i in range(50):
+            kv.put(f'key{i}', i)
+        time.sleep(0.5)
+        assert kv2.get('key49') == 49
+        kv.put('metric', 10)
+        with pytest.raises(ValueError):
+            kv.incr('metric')
+        # incr flushes the buffer first
+        assert kv2.get('metric') == 10
+        kv.put('metric', 11)
+        kv.stop()
+        assert kv2.get('metric') == 11
+        # puts after stop are written directly
+        kv.put('late', 1)
+        kv.put_many({'late2': 2})
+        assert kv2.get_many(['late', 'late2']) == {'late': 1, 'late2': 2}
+        # stopped storages are not kept by the exit handler
+        import gc
+        import weakref
+        ref = weakref.ref(kv)
+        del kv
+        gc.collect()
+        assert ref() is None
+        kv = pyaltt2.db.KVStorage(db=db, write_behind=True, flush_interval=60)
+        ref = weakref.ref(kv)
+        del kv
+        gc.collect()
+        assert ref() is None
+    finally:
+        os.unlink('/tmp/pyaltt2-test-kv.db')
+
+
+def test_kv_tags():
+    try:
+        db = pyaltt2.db.Database('/tmp/pyaltt2-test-kv.db')
+        for kv in (pyaltt2.db.KVStorage(db=db, table_name='kv1', tags=True),
+                   pyaltt2.db.KVStorage(db=db,
+                                        table_name='kv2',
+                                        tags=True,
+                                        write_behind=True,
+                                        flush_interval=60),
+                   pyaltt2.db.ShardedKVStorage(db=db,
+                                               tables=3,
+                                               table_name='kv3',
+                                               tags=True)):
+            kv.put_many({f'user1/{i}': i for i in range(10)},
+                        tags=['user1', 'perm'])
+            kv.put('user2/1', 1, tags=['user2', 'perm'])
+            kv.put('user2/2', 2, tags=['user2'])
+            kv.put('user1/5', 5, tags=['user2'])
+            kv.flush()
+            kv.put('user1/6', 6, tags=['user2'])
+            assert kv.delete_by_tag('user1') == 8
+            assert kv.get('user1/5') == 5
+            assert kv.get('user1/6') == 6
+            with pytest.raises(LookupError):
+                kv.get('user1/0')
+            assert kv.delete_by_tag('perm') == 1
+            assert kv.delete_by_tag('user2') == 3
+            assert kv.delete_by_tag('user2') == 0
+            # object is stored and buffered with the same tag
+            kv.put('user3/1', 1, tags=['user3'])
+            kv.flush()
+            kv.put('user3/1', 2, tags=['user3'])
+            kv.put('user3/2', 2, tags=['user3'])
+            assert kv.delete_by_tag('user3') == 2
+            with pytest.raises(LookupError):
+                kv.get('user3/1')
+            kv.cleanup()
+        kv = pyaltt2.db.KVStorage(db=db, table_name='kv4')
+        with pytest.raises(ValueError):
+            kv.put('test', 1, tags=['test'])
+    finally:
+        os.unlink('/tmp/pyaltt2-test-kv.db')
+
+
+def test_kv_streams():
+    try:
+        db = pyaltt2.db.Database('/tmp/pyaltt2-test-kv.db')
+        kv = pyaltt2.db.KVStorage(db=db,
+                                  streams=True,
+                                  tags=True,
+                                  chunk_size=1000)
+        data = [os.urandom(700) for _ in range(10)]
+        kv.put_stream('stream', iter(data), tags=['test'])
+        chunks = list(kv.get_stream('stream'))
+        assert len(chunks) == 7
+        assert {len(c) for c in chunks[:-1]} == {1000}
+        assert b''.join(chunks) == b''.join(data)
+        assert kv.get('stream') == b''.join(data)
+        with pytest.raises(ValueError):
+            pyaltt2.db.kv_decode(
+                kv.db.query('kv.get', qargs=['kv'],
+                            id='stream').fetchone().content)
+        kv.put_stream('stream', [b'x' * 10000])
+        assert b''.join(kv.get_stream('stream')) == b'x' * 10000
+        kv.put('stream', b'123')
+        assert list(kv.get_stream('stream')) == [b'123']
+        assert not db.lookup('SELECT COUNT(*) AS c FROM kv_chunks')['c']
+        kv.put('test', 123)
+        with pytest.raises(ValueError):
+            kv.get_stream('test')
+        kv.put_stream('expired', [b'x' * 5000], expires=-1)
+        kv.put_stream('stream', [b'x' * 5000])
+        kv.cleanup()
+        with pytest.raises(LookupError):
+            kv.get_stream('expired')
+        assert db.lookup('SELECT COUNT(*) AS c FROM kv_chunks')['c'] == 5
+        kv.delete('stream')
+        kv.put_stream('stream', [b'x' * 5000], tags=['test'])
+        kv.delete_by_tag('test')
+        assert not db.lookup('SELECT COUNT(*) AS c FROM kv_chunks')['c']
+    finally:
+        os.unlink('/tmp/pyaltt2-test-kv.db')
+
+
+def test_logs_memory():
+    import asyncio
+    logs = pyaltt2.logs
+    logs._log_records.clear()
+    t = time.time()
+    for i in range(3000):
+        logs.append(rd={
+            't': t - 3000 + i,
+            'msg': f'record {i}',
+            'l': 20 if i % 2 else 30,
+            'mod': 'test'
+        })
+    assert len(logs.get(n=5000)) == 3000
+    logs.config.keep_logmem = 1000.5
+    asyncio.run(logs.clean())
+    recs = logs.get(n=5000)
+    assert len(recs) == 1000
+    assert recs[0]['msg'] == 'record 2000'
+    assert len(logs.get(level=30, n=5000)) == 500
+    assert [r['msg'] for r in logs.get(t=3.5)] == ['record 2997',
+                                                  'record 2998',
+                                                  'record 2999']
+    assert len(logs.get(pattern='record 29')) == 100
+    recs = logs.get(level=30, n=3)
+    assert [r['msg'] for r in recs] == ['record 2994', 'record 2996',
+                                        'record 2998']
+    recs = logs.get(level=30, n=2, after=recs[0]['id'])
+    assert [r['msg'] for r in recs] == ['record 2996', 'record 2998']
+    assert logs.get(after=recs[-1]['id'] + 1) == []
+    assert [r['msg'] for r in logs.get(level=30, t=5.5, n=10)
+           ] == ['record 2996', 'record 2998']
+    assert [r['msg'] for r in logs.get(pattern='RECORD 29[89]1', n=10)
+           ] == ['record 2981', 'record 2991']
+    logs.config.keep_logmem_records = 10
+    logs.append(rd={'t': time.time(), 'msg': 'last', 'l': 20, 'mod': 'test'})
+    assert len(logs.get()) == 10
+    assert logs.get()[-1]['msg'] == 'last'
+    logs.config.keep_logmem_records = 0
+    logs.config.keep_logmem_bytes = logs.LOG_RECORD_OVERHEAD * 5
+    logs.append(rd={'t': time.time(), 'msg': 'x', 'l': 20, 'mod': 'test'})
+    assert len(logs.get()) == 4
+    logs.config.keep_logmem_bytes = 0
+    logs.config.keep_logmem = 0
+    logs._log_records.clear()
+
+
+def test_logs_async_handlers():
+    logs = pyaltt2.logs
+    try:
+        logs.init(keep_logmem=60,
+                  log_stdout=0,
+                  level=10,
+                  async_handlers=True,
+                  async_queue_size=10,
+                  async_overflow='drop_debug')
+        logs._log_records.clear()
+        handler = logs.__data.listener.handlers[0]
+        emit = handler.emit
+        ev = threading.Event()
+
+        def slow_emit(record):
+            ev.wait()
+            emit(record)
+
+        handler.emit = slow_emit
+        logging.warning('first')
+        time.sleep(0.1)
+        for i in range(10):
+            logging.debug('debug %s', i)
+        for i in range(5):
+            logging.warning('warning %s', i)
+        ev.set()
+        logs.flush()
+        recs = logs.get(n=100, level=10)
+        assert [r['msg'] for r in recs if r['l'] == 30
+               ] == ['first'] + [f'warning {i}' for i in range(5)]
+        assert len(recs) == 11
+        assert logs.serialize()['dropped_records']['queue'] == 5
+    finally:
+        logs.init(log_stdout=0, keep_logmem=0, level=20, async_handlers=False)
+        logs._log_records.clear()
+
+
+def test_logs_spill():
+    import shutil
+    logs = pyaltt2.logs
+    path = '/tmp/pyaltt2-test-logs-spill'
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        logs.init(keep_logmem=60,
+                  keep_logmem_records=100,
+                  log_stdout=0,
+                  logmem_spill_dir=path,
+                  logmem_spill_segment=10000)
+        logs._log_records.clear()
+        t = time.time()
+        for i in range(1000):
+            logs.append(rd={
+                't': t - 1000 + i,
+                'msg': f'record {i}',
+                'l': 20 if i % 2 else 30,
+                'mod': 'test',
+                'th': 'main'
+            })
+        assert len(logs._log_records) == 100
+        assert len(logs.__data.spill.segments) > 1
+        recs = logs.get(n=1000)
+        assert [r['msg'] for r in recs] == [f'record {i}' for i in range(1000)]
+        assert recs[0]['th'] == 'main'
+        assert [r['msg'] for r in logs.get(level=30, n=3, t=5.5)
+               ] == ['record 996', 'record 998']
+        assert [
+            r['msg']
+            for r in logs.get(level=30, n=3, t=150.5, after=recs[0]['id'])
+        ] == ['record 850', 'record 852', 'record 854']
+        recs = logs.get(after=recs[10]['id'], n=3)
+        assert [r['msg'] for r in recs
+               ] == ['record 11', 'record 12', 'record 13']
+        assert len(logs.get(pattern='record 1.5$', n=1000)) == 10
+        last_id = logs.get(n=1)[0]['id']
+        # restart
+        logs._log_records.clear(base=0)
+        logs._log_records.base = 0
+        logs.init(keep_logmem_spill_bytes=45000)
+        assert logs.get(n=1)[0]['id'] == last_id
+        logs.append(rd={'t': time.time(), 'msg': 'new', 'l': 20, 'mod': 'test'})
+        recs = logs.get(n=1000)
+        assert recs[-1]['id'] == last_id + 1
+        assert recs[-1]['msg'] == 'new'
+        assert len(recs) < 1000
+        assert recs[0]['msg'] != 'record 0'
+    finally:
+        logs.init(log_stdout=0,
+                  keep_logmem=0,
+                  keep_logmem_records=0,
+                  logmem_spill_dir=None,
+                  keep_logmem_spill_bytes=0)
+        logs._log_records.clear()
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def test_logs_metrics():
+    logs = pyaltt2.logs
+    try:
+        logs.init(keep_logmem=60,
+                  log_stdout=0,
+                  metrics=True,
+                  sampling=[{
+                      'level': 20,
+                      'rate': 0
+                  }])
+        logs._metrics.reset()
+        with logs._dropped_lock:
+            sampled = logs._dropped_records['sampling']
+        for i in range(3):
+            logging.warning('warning')
+        logging.info('info')
+        logging.error('error\n"x"')
+        m = logs.metrics()
+        assert m['records']['level'] == {'INFO': 1, 'WARNING': 3, 'ERROR': 1}
+        assert m['records']['module'] == {'test': 5}
+        h = m['handlers']['MemoryLogHandler']
+        assert h['count'] == 4
+        assert h['buckets'][float('inf')] == 4
+        assert h['sum'] > 0
+        assert m['dropped']['sampling'] == sampled + 1
+        text = logs.metrics_prometheus()
+        assert 'pyaltt2_logs_records_total{level="WARNING"} 3\n' in text
+        assert '# TYPE pyaltt2_logs_handler_emit_seconds histogram\n' in text
+        assert ('pyaltt2_logs_handler_emit_seconds_bucket'
+                '{handler="MemoryLogHandler",le="+Inf"} 4\n') in text
+        assert 'pyaltt2_logs_handler_emit_seconds_count' \
+            '{handler="MemoryLogHandler"} 4\n' in text
+    finally:
+        logs.init(log_stdout=0, keep_logmem=0, metrics=False, sampling=None)
+        logs._log_records.clear()
+        logs._metrics.reset()
+
+
+def test_logs_exceptions():
+    import traceback
+    logs = pyaltt2.logs
+    logs._exceptions.clear()
+    format_exception = traceback.format_exception
+    formatted = []
+
+    def counting_format_exception(*args, **kwargs):
+        formatted.append(args)
+        return format_exception(*args, **kwargs)
+
+    def fail(i):
+        raise ValueError(f'test {i}')
+
+    traceback.format_exception = counting_format_exception
+    try:
+        for i in range(5):
+            try:
+                fail(i)
+            except ValueError:
+                logs.log_traceback()
+        assert not formatted
+        assert logs.serialize_exceptions() == []
+        logs.config.keep_exceptions = 2
+        for i in range(5):
+            try:
+                fail(i)
+            except ValueError:
+                logs.log_traceback()
+        assert len(formatted) == 1
+        for e in (KeyError('x'), RuntimeError('y')):
+            try:
+                raise e
+            except Exception as exc:
+                logs.log_traceback(e=exc)
+        ex = logs.serialize_exceptions()
+        assert [e['e']['class'] for e in ex] == ['KeyError', 'RuntimeError']
+        logs.config.keep_exceptions = 10
+        for i in range(3):
+            try:
+                fail(i)
+            except ValueError:
+                logs.log_traceback(e=sys.exc_info())
+        ex = logs.serialize_exceptions()
+        assert len(ex) == 3
+        assert ex[-1]['count'] == 3
+        assert ex[-1]['e']['msg'] == 'test 2'
+        assert 'in fail' in ex[-1]['e']['trace']
+        assert ex[-1]['first_t'] <= ex[-1]['t']
+        assert logs.serialize()['exceptions'] == ex
+    finally:
+        traceback.format_exception = format_exception
+        logs.config.keep_exceptions = 0
+        logs._exceptions.clear()
+
+
+def test_logs_mem_record():
+    import datetime
+    logs = pyaltt2.logs
+    logs._log_records.clear()
+    appended = []
+    t = time.time()
+    try:
+        logs.handle_append = lambda rd, **kwargs: appended.append(rd)
+        logs.append(rd={
+            't': t,
+            'msg': 'test',
+            'l': 20,
+            'mod': 'test',
+            'th': 'main',
+            'x': 1
+        })
+        r = logs.get()[0]
+        assert appended == [r]
+        assert r['x'] == 1
+        assert r['th'] == 'main'
+        assert 'h' not in r
+        if logs.LOCAL_TZ:
+            assert r['dt'] == datetime.datetime.fromtimestamp(t).replace(
+                tzinfo=logs.LOCAL_TZ).isoformat()
+        rec = logs._log_records.records[-1]
+        assert rec.mod is sys.intern('test')
+        with pytest.raises(AttributeError):
+            rec.y = 1
+    finally:
+        logs.handle_append = logs._handle_append_default
+        logs._log_records.clear()
+
+
+def test_logs_subscribe():
+    import asyncio
+    logs = pyaltt2.logs
+
+    def append(msg, level=20, mod='test'):
+        logs.append(rd={'t': time.time(), 'msg': msg, 'l': level, 'mod': mod})
+
+    sub = logs.subscribe(level=30, mods=['test'], pattern='^x')
+    slow = logs.subscribe(queue_size=2)
+    try:
+        append('x1')
+        append('x2', level=30)
+        append('x3', level=30, mod='other')
+        append('y4', level=30)
+        append('x5', level=40)
+        assert slow.dropped and not slow.active
+        assert [r['msg'] for r in slow] == ['x1', 'x2']
+        assert sub.get(timeout=1)['msg'] == 'x2'
+        assert sub.get()['msg'] == 'x5'
+        assert sub.get(timeout=0.01) is None
+        logs.unsubscribe(sub)
+        assert list(sub) == []
+        assert logs._subscribers == []
+
+        async def consume():
+            asub = logs.subscribe_async(level=30)
+            result = []
+
+            async def reader():
+                async for r in asub:
+                    result.append(r['msg'])
+
+            task = asyncio.ensure_future(reader())
+            await asyncio.sleep(0.01)
+            threading.Thread(target=append, args=('a1', 30)).start()
+            await asyncio.sleep(0.1)
+            assert result == ['a1']
+            append('a2', level=10)
+            append('a3', level=30)
+            logs.unsubscribe(asub)
+            await asyncio.wait_for(task, timeout=1)
+            return result
+
+        assert asyncio.run(consume()) == ['a1', 'a3']
+        # records are delivered when they are not kept in memory
+        logs.init(keep_logmem=0, log_stdout=0)
+        sub = logs.subscribe()
+        logging.warning('not in memory %s', 1)
+        assert sub.get(timeout=1)['msg'] == 'not in memory 1'
+        assert sub.get(timeout=0.01) is None
+        assert 'not in memory 1' not in [r['msg'] for r in logs.get()]
+    finally:
+        logs.unsubscribe(sub)
+        logs.unsubscribe(slow)
+        logs._log_records.clear()
+
+
+def test_logs_shared():
+    import multiprocessing
+    logs = pyaltt2.logs
+    name = f'pyaltt2-test-logs-{os.getpid()}'
+
+    def worker():
+        logs.init(keep_logmem=60, log_stdout=0, logmem_shared=name)
+        for i in range(3):
+            logging.warning('worker %s', i)
+
+    try:
+        logs.init(keep_logmem=60,
+                  log_stdout=0,
+                  logmem_shared=name,
+                  logmem_shared_workers=4,
+                  logmem_shared_slots=16,
+                  logmem_shared_slot_size=128)
+        logging.warning('master')
+        proc = multiprocessing.Process(target=worker)
+        proc.start()
+        proc.join()
+        recs = logs.get()
+        assert [r['msg'] for r in recs
+               ] == ['master', 'worker 0', 'worker 1', 'worker 2']
+        assert recs[1]['mod'] == 'test'
+        time.sleep(logs.SHARED_CURSOR_DELAY * 2)
+        assert [r['msg'] for r in logs.get(after=recs[2]['id'])
+               ] == ['worker 2']
+        # record, created earlier but appended after the cursor
+        cursor = recs[-1]['id']
+        logging.getLogger().handle(
+            logging.makeLogRecord({
+                'msg': 'late',
+                'levelno': 30,
+                'levelname': 'WARNING',
+                'created': time.time() - 5
+            }))
+        assert logs.get(after=cursor) == []
+        time.sleep(logs.SHARED_CURSOR_DELAY * 2)
+        assert [r['msg'] for r in logs.get(after=cursor)] == ['late']
+        logging.warning('long %s', 'x' * 1000)
+        logging.warning('after long')
+        msgs = [r['msg'] for r in logs.get(n=2)]
+        assert msgs[0].startswith('long xxx') and len(msgs[0]) > 500
+        assert msgs[1] == 'after long'
+        for i in range(20):
+            logging.warning('master %s', i)
+        msgs = [r['msg'] for r in logs.get(n=100)]
+        assert msgs[:3] == ['worker 0', 'worker 1', 'worker 2']
+        assert msgs[3:] == [f'master {i}' for i in range(4, 20)]
+    finally:
+        shared = logs.__data.shared
+        logs.init(log_stdout=0, keep_logmem=0, logmem_shared=None)
+        if shared:
+            shared.unlink()
+
+
+def test_logs_storm():
+    logs = pyaltt2.logs
+    try:
+        logs.init(keep_logmem=60, log_stdout=0, storm_limit=3, storm_window=0.2)
+        logs._log_records.clear()
+
+        def storm(i):
+            logging.warning('storm %s', i)
+
+        for i in range(100):
+            storm(i)
+        logging.warning('other')
+        assert [r['msg'] for r in logs.get()
+               ] == ['storm 0', 'storm 1', 'storm 2', 'other']
+        time.sleep(0.3)
+        storm(100)
+        assert [r['msg'] for r in logs.get()][-2:] == [
+            'storm 99 (message repeated 97 times)', 'storm 100'
+        ]
+        for i in range(5):
+            logs.append(rd={
+                't': time.time(),
+                'msg': 'rd storm',
+                'l': 20,
+                'mod': 'test'
+            })
+        time.sleep(0.3)
+        logs.__data.storm.flush()
+        assert [r['msg'] for r in logs.get()][-4:] == [
+            'rd storm', 'rd storm', 'rd storm',
+            'rd storm (message repeated 2 times)'
+        ]
+        # suppressed records, their args and tracebacks are not kept
+        import gc
+        import weakref
+
+        class Arg:
+            pass
+
+        def storm_exc(arg):
+            try:
+                raise RuntimeError
+            except RuntimeError:
+                logging.exception('exc storm %s', arg)
+
+        refs = []
+        for i in range(5):
+            arg = Arg()
+            refs.append(weakref.ref(arg))
+            storm_exc(arg)
+        del arg
+        gc.collect()
+        assert not [r for r in refs if r() is not None]
+        for i in range(5):
+            logging.warning({'storm': i})
+            logging.warning(['storm', i])
+        assert [r['msg'] for r in logs.get()][-6:] == [
+            "{'storm': 0}", "['storm', 0]", "{'storm': 1}", "['storm', 1]",
+            "{'storm': 2}", "['storm', 2]"
+        ]
+    finally:
+        logs.init(log_stdout=0, keep_logmem=0, storm_limit=0)
+        logs._log_records.clear()
+
+
+def test_logs_sampling():
+    logs = pyaltt2.logs
+    with pytest.raises(ValueError):
+        logs.SamplingFilter([{'rate': 2}])
+    f = logs.SamplingFilter([{
+        'mod': 'chatty',
+        'level': 10,
+        'rate': 0.01,
+        'mode': 'deterministic'
+    }, {
+        'mod': 'chatty',
+        'rate': 0.5
+    }, {
+        'level': 10,
+        'rate': 0
+    }])
+    assert sum(f.check('chatty', 10) for _ in range(1000)) == 10
+    assert 400 < sum(f.check('chatty', 20) for _ in range(1000)) < 600
+    assert not f.check('other', 10)
+    assert f.check('other', 20)
+    try:
+        logs.init(keep_logmem=60,
+                  log_stdout=0,
+                  level=10,
+                  sampling=[{
+                      'mod': 'test',
+                      'level': 10,
+                      'rate': 0.1,
+                      'mode': 'deterministic'
+                  }])
+        logs._log_records.clear()
+        for i in range(100):
+            logging.debug('debug %s', i)
+            logging.warning('warning %s', i)
+        assert len(logs.get(level=10, n=1000)) == 110
+        for i in range(100):
+            logs.append(rd={
+                't': time.time(),
+                'msg': 'rd',
+                'l': 10,
+                'mod': 'test'
+            })
+        assert len(logs.get(level=10, n=1000)) == 120
+    finally:
+        logs.init(log_stdout=0, keep_logmem=0, level=20, sampling=None)
+        logs._log_records.clear()
+
+
+def test_logs_filter_pipeline():
+    import io
+    logs = pyaltt2.logs
+    formatted = []
+
+    class Arg:
+
+        def __str__(self):
+            formatted.append(1)
+            return 'arg'
+
+    try:
+        logs.init(keep_logmem=60,
+                  log_stdout=1,
+                  colorize=False,
+                  ignore='.',
+                  ignore_mods=['ignored'])
+        logs._log_records.clear()
+        stream = io.StringIO()
+        for h in logging.getLogger().handlers:
+            if isinstance(h, logs.StdoutHandler):
+                h.setStream(stream)
+        logging.warning('test %s', Arg())
+        logging.warning('.hidden')
+        logging.info('.hidden')
+        assert len(formatted) == 1
+        assert [r['msg'] for r in logs.get(level=10)
+               ] == ['test arg', '.hidden']
+        assert stream.getvalue().count('test arg') == 1
+        assert 'hidden' not in stream.getvalue()
+        logs.append(rd={'t': time.time(), 'msg': 'x', 'l': 20, 'mod': 'ignored'})
+        logs.append(rd={'t': time.time(), 'msg': '.y', 'l': 20, 'mod': 'test'})
+        assert len(logs.get(level=10)) == 2
+    finally:
+        logs.init(log_stdout=0,
+                  keep_logmem=0,
+                  colorize=True,
+                  ignore=None,
+                  ignore_mods=[])
+        logs._log_records.clear()
+
+
+def test_logs_collector():
+    logs = pyaltt2.logs
+    path = '/tmp/pyaltt2-test-logs-collector.sock'
+    proc = logs.spawn_collector(path, keep_logmem=60, log_stdout=0, level=10)
+    try:
+        logs.init(collector=path, level=10)
+        sub = logs.subscribe()
+        logging.info('worker %s', 1)
+        assert sub.get(timeout=1)['msg'] == 'worker 1'
+        logs.unsubscribe(sub)
+        try:
+            raise ValueError('test')
+        except ValueError:
+            logging.exception('failed')
+        for _ in range(50):
+            recs = logs.get(level=10)
+            if len(recs) >= 2:
+                break
+            time.sleep(0.1)
+        assert [r['msg'] for r in recs] == ['worker 1', 'failed']
+        assert recs[0]['mod'] == 'test'
+        assert [r['msg'] for r in logs.get(level=40)] == ['failed']
+        handler = logging.getLogger().handlers[0]
+        assert isinstance(handler, logs.CollectorHandler)
+        with logs._dropped_lock:
+            dropped = logs._dropped_records['collector']
+        proc.terminate()
+        proc.join()
+        for _ in range(3):
+            logging.info('collector is down')
+        with logs._dropped_lock:
+            assert logs._dropped_records['collector'] > dropped
+        assert logs.get() == []
+    finally:
+        proc.terminate()
+        logs.init(collector=None, log_stdout=0, level=20)
+
+
+def test_logs_json_formatter():
+    import json
+    fmt = pyaltt2.logs.JSONFormatter()
+    record = logging.makeLogRecord({
+        'msg': 'test "%s"',
+        'args': (1,),
+        'levelno': 30,
+        'levelname': 'WARNING',
+        'module': 'test',
+        'request_id': 123
+    })
+    d = json.loads(fmt.format(record))
+    assert d['msg'] == 'test "1"'
+    assert d['l'] == 30
+    assert d['mod'] == 'test'
+    assert d['request_id'] == 123
+    assert 'args' not in d
+    try:
+        raise ValueError('test')
+    except ValueError:
+        record.exc_info = sys.exc_info()
+    assert 'ValueError: test' in json.loads(fmt.format(record))['exc']
+    assert 'request_id' not in json.loads(
+        pyaltt2.logs.JSONFormatter(extra=False).format(record))
+
+
+def test_logs_buffered_file():
+    import gzip
+    import shutil
+    path = '/tmp/pyaltt2-test-logs-file'
+    shutil.rmtree(path, ignore_errors=True)
+    os.mkdir(path)
+    fname = f'{path}/test.log'
+    fmt = logging.Formatter('%(message)s')
+    default_fmt = pyaltt2.logs.config.formatter
+    record = lambda msg, level=logging.INFO: logging.makeLogRecord({
+        'msg': msg,
+        'levelno': level
+    })
+    try:
+        h = pyaltt2.logs.BufferedFileHandler(fname, flush_interval=0.1)
+        h.setFormatter(fmt)
+        h.handle(record('buffered'))
+        assert os.path.getsize(fname) == 0
+        h.handle(record('error', logging.ERROR))
+        with open(fname) as fh:
+            assert fh.read() == 'buffered\nerror\n'
+        h.handle(record('flushed'))
+        time.sleep(0.3)
+        with open(fname) as fh:
+            assert fh.read().endswith('flushed\n')
+        # external rotation is detected by the handler thread
+        os.rename(fname, fname + '.old')
+        time.sleep(0.3)
+        h.handle(record('reopened'))
+        h.close()
+        with open(fname) as fh:
+            assert fh.read() == 'reopened\n'
+        os.unlink(fname)
+        os.unlink(fname + '.old')
+        h = pyaltt2.logs.BufferedFileHandler(fname,
+                                             max_bytes=100,
+                                             backup_count=2)
+        h.setFormatter(fmt)
+        for i in range(40):
+            h.handle(record(f'record {i:04d}'))
+        h.close()
+        assert sorted(os.listdir(path)) == [
+            'test.log', 'test.log.1.gz', 'test.log.2.gz'
+        ]
+        with gzip.open(fname + '.1.gz', 'rt') as fh:
+            assert fh.read().split() == [
+                x for i in range(27, 36) for x in ('record', f'{i:04d}')
+            ]
+        with open(fname) as fh:
+            assert fh.read().splitlines()[-1] == 'record 0039'
+        shutil.rmtree(path)
+        os.mkdir(path)
+        # rotated file, left by a crashed process
+        with open(f'{fname}.1700000000000000000.rotated', 'w') as fh:
+            fh.write('orphan\n')
+        # rotation without buffering
+        pyaltt2.logs.init(log_file=fname,
+                          log_file_max_bytes=1000,
+                          log_stdout=0,
+                          formatter=fmt)
+        logging.warning('unbuffered')
+        with open(fname) as fh:
+            assert fh.read() == 'unbuffered\n'
+        pyaltt2.logs.init(log_file=None, log_file_max_bytes=0)
+        assert sorted(os.listdir(path)) == ['test.log', 'test.log.1.gz']
+        with gzip.open(fname + '.1.gz', 'rt') as fh:
+            assert fh.read() == 'orphan\n'
+    finally:
+        pyaltt2.logs.init(log_file=None,
+                          log_file_max_bytes=0,
+                          formatter=default_fmt)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def test_logs_syslog_tcp():
+    import re
+    import socket
+    logs = pyaltt2.logs
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    port = server.getsockname()[1]
+    received = []
+
+    def serve():
+        conn, _ = server.accept()
+        with conn:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                received.append(data)
+
+    t = threading.Thread(target=serve, daemon=True)
+    t.start()
+    h = logs.SyslogTCPHandler(('127.0.0.1', port),
+                              app_name='test app',
+                              hostname='host')
+    h.setFormatter(logging.Formatter('%(message)s'))
+    try:
+        for i, level in enumerate((logging.INFO, logging.ERROR, 5)):
+            h.handle(
+                logging.makeLogRecord({
+                    'msg': 'test %s',
+                    'args': (i,),
+                    'levelno': level
+                }))
+        h.flush()
+    finally:
+        h.close()
+        t.join(5)
+        server.close()
+    data = b''.join(received)
+    msgs = []
+    while data:
+        size, data = data.split(b' ', 1)
+        msgs.append(data[:int(size)].decode())
+        data = data[int(size):]
+    pid = os.getpid()
+    for msg, pri, text in zip(msgs, (14, 11, 15), ('test 0', 'test 1', 'test 2')):
+        assert re.fullmatch(
+            rf'<{pri}>1 \d{{4}}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{{6}}Z '
+            rf'host testapp {pid} - - {text}', msg), msg
+    assert len(msgs) == 3
+    # unavailable server: records over queue size are dropped
+    with logs._dropped_lock:
+        dropped = logs._dropped_records['syslog']
+    h = logs.SyslogTCPHandler(('127.0.0.1', port), queue_size=2)
+    for i in range(10):
+        h.handle(logging.makeLogRecord({'msg': 'test', 'levelno': 20}))
+    h.flush()
+    h.close()
+    with logs._dropped_lock:
+        assert logs._dropped_records['syslog'] == dropped + 10
+
+
+def test_logs_syslog_tcp_reinit():
+    import socket
+    logs = pyaltt2.logs
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(10)
+    port = server.getsockname()[1]
+    conns = []
+
+    def serve():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                break
+            conns.append(conn)
+
+    def syslog_threads():
+        return [
+            t for t in threading.enumerate()
+            if t.name == 'pyaltt2:logs:syslog'
+        ]
+
+    t = threading.Thread(target=serve, daemon=True)
+    t.start()
+    try:
+        for i in range(5):
+            logs.init(syslog=f'tcp://127.0.0.1:{port}', log_stdout=0)
+            logging.warning('reinit %s', i)
+            logs.flush()
+        assert len(syslog_threads()) == 1
+        assert len(conns) == 5
+        # connections of the previous handlers are closed
+        for conn in conns[:4]:
+            conn.settimeout(1)
+            while conn.recv(65536):
+                pass
+        logs.init(syslog=None, log_stdout=0)
+        assert not syslog_threads()
+    finally:
+        logs.init(syslog=None, log_stdout=0)
+        server.close()
+        for conn in conns:
+            conn.close()
+
+
 def test_res():
     rs1 = pyaltt2.res.ResourceStorage('./rtest/resources')
     rs2 = pyaltt2.res.ResourceStorage(mod='rtest')